@@ -3,9 +3,138 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <unistd.h>
+
+// protocol versions, legacy frames are one byte per pixel without a header
+#define PROTOCOL_VERSION 3
+
+// header byte of the versioned messages
+#define MSG_HELLO 0xF0
+#define MSG_FRAME 0xF1
+#define MSG_DELTA 0xF2
+#define MSG_HEARTBEAT 0xF3
+
+// I2C control byte announcing a stream of GDDRAM data bytes
+#define I2C_CTRL_DATA_STREAM 0x40
 
 zsock_t *server = NULL;
 
+static void put_legacy_frame(ssd1306_framebuffer_t *fbp, const byte *data,
+                             size_t size) {
+  ssd1306_framebuffer_clear(fbp);
+  size_t written = 0;
+  for (uint8_t y = 0; y < fbp->height; ++y) {
+    for (uint8_t x = 0; x < fbp->width; ++x) {
+      if (written >= size) {
+        return;
+      }
+      int idx = y * fbp->width + x;
+      ssd1306_framebuffer_put_pixel(fbp, x, y, data[idx] > 0);
+      written += 1;
+    }
+  }
+}
+
+// packed frames already are in the controller page layout, same as the
+// framebuffer: one byte per column for each 8 rows page, LSB at the top
+static int put_packed_frame(ssd1306_framebuffer_t *fbp, const byte *data,
+                            size_t size) {
+  if (size != fbp->len) {
+    fprintf(stderr, "Error: packed frame has %zu bytes, expected %zu\n", size,
+            fbp->len);
+    return -1;
+  }
+  memcpy(fbp->buffer, data, size);
+  return 0;
+}
+
+typedef struct {
+  uint8_t page;
+  uint8_t column;
+  uint8_t count;
+} delta_range_t;
+
+// delta frames are a count of ranges followed by (page, column, count, data)
+// for each range, the ranges are copied into the framebuffer and collected
+// to be sent as partial updates
+static int put_delta_frame(ssd1306_framebuffer_t *fbp, const byte *data,
+                           size_t size, delta_range_t *ranges,
+                           size_t *range_count, size_t *changed) {
+  if (size < 1) {
+    return -1;
+  }
+
+  size_t count = data[0];
+  size_t pos = 1;
+  uint8_t pages = fbp->height / 8;
+
+  *range_count = 0;
+  *changed = 0;
+
+  for (size_t i = 0; i < count; ++i) {
+    if (pos + 3 > size) {
+      return -1;
+    }
+    delta_range_t range = {data[pos], data[pos + 1], data[pos + 2]};
+    pos += 3;
+
+    if (range.page >= pages || range.count == 0 ||
+        (size_t)range.column + range.count > fbp->width ||
+        pos + range.count > size || *range_count >= pages) {
+      return -1;
+    }
+
+    memcpy(fbp->buffer + range.page * fbp->width + range.column, data + pos,
+           range.count);
+    pos += range.count;
+
+    ranges[(*range_count)++] = range;
+    *changed += range.count;
+  }
+
+  return pos == size ? 0 : -1;
+}
+
+static int display_update_range(ssd1306_i2c_t *oled,
+                                const ssd1306_framebuffer_t *fbp,
+                                delta_range_t range) {
+  uint8_t columns[2] = {range.column, range.column + range.count - 1};
+  if (ssd1306_i2c_run_cmd(oled, SSD1306_I2C_CMD_COLUMN_ADDR, columns, 2) < 0) {
+    return -1;
+  }
+  uint8_t pages[2] = {range.page, range.page};
+  if (ssd1306_i2c_run_cmd(oled, SSD1306_I2C_CMD_PAGE_ADDR, pages, 2) < 0) {
+    return -1;
+  }
+
+  uint8_t buf[1 + 255];
+  buf[0] = I2C_CTRL_DATA_STREAM;
+  memcpy(buf + 1, fbp->buffer + range.page * fbp->width + range.column,
+         range.count);
+
+  ssize_t len = 1 + range.count;
+  return write(oled->fd, buf, len) == len ? 0 : -1;
+}
+
+// small deltas are sent as partial updates, when most of the panel changed a
+// single full update is cheaper than addressing every range
+static int display_update_delta(ssd1306_i2c_t *oled,
+                                const ssd1306_framebuffer_t *fbp,
+                                const delta_range_t *ranges,
+                                size_t range_count, size_t changed) {
+  if (changed * 2 > fbp->len) {
+    return ssd1306_i2c_display_update(oled, fbp);
+  }
+
+  for (size_t i = 0; i < range_count; ++i) {
+    if (display_update_range(oled, fbp, ranges[i]) < 0) {
+      return ssd1306_i2c_display_update(oled, fbp);
+    }
+  }
+
+  return 0;
+}
+
 int main(void) {
   const char *port_env = getenv("SERVER_PORT");
   const char *i2c_dev_env = getenv("PULL_UPDOWN");
@@ -55,6 +184,19 @@ int main(void) {
 
   zpoller_t *poller = zpoller_new(server, NULL);
 
+  byte ack_data[] = {0x61};
+  byte nack_data[] = {0x6e};
+
+  // deltas and heartbeats are only valid once a whole frame was received,
+  // a restarted server nacks them and the client sends the whole frame
+  int have_frame = 0;
+
+  delta_range_t *ranges = calloc(fbp->height / 8, sizeof(delta_range_t));
+  if (!ranges) {
+    fprintf(stderr, "Error: Could not allocate delta ranges\n");
+    return 1;
+  }
+
   while (!zsys_interrupted) {
     void *which = zpoller_wait(poller, 1000);
 
@@ -73,26 +215,51 @@ int main(void) {
       byte *data = zframe_data(frame);
       size_t size = zframe_size(frame);
 
-      ssd1306_framebuffer_clear(fbp);
-      size_t written = 0;
-      for (uint8_t y = 0; y < fbp->height; ++y) {
-        if (written > size) {
-          break;
+      if (size == (size_t)fbp->width * fbp->height) {
+        put_legacy_frame(fbp, data, size);
+        have_frame = 1;
+        ssd1306_i2c_run_cmd(oled, SSD1306_I2C_CMD_POWER_ON, 0, 0);
+        ssd1306_i2c_display_update(oled, fbp);
+        zsock_send(server, "b", ack_data, 1);
+      } else if (size > 0 && data[0] == MSG_HELLO) {
+        byte hello_data[] = {0x61, PROTOCOL_VERSION};
+        zsock_send(server, "b", hello_data, 2);
+      } else if (size > 0 && data[0] == MSG_FRAME) {
+        if (put_packed_frame(fbp, data + 1, size - 1) == 0) {
+          have_frame = 1;
+          ssd1306_i2c_run_cmd(oled, SSD1306_I2C_CMD_POWER_ON, 0, 0);
+          ssd1306_i2c_display_update(oled, fbp);
+          zsock_send(server, "b", ack_data, 1);
+        } else {
+          zsock_send(server, "b", nack_data, 1);
         }
-        for (uint8_t x = 0; x < fbp->width; ++x) {
-          if (written > size) {
-            break;
+      } else if (size == 1 && data[0] == MSG_HEARTBEAT) {
+        // only keeps the screen from being powered off, a restarted server
+        // nacks it to get the whole frame instead of keeping its splash on
+        zsock_send(server, "b", have_frame ? ack_data : nack_data, 1);
+      } else if (size > 0 && data[0] == MSG_DELTA && !have_frame) {
+        zsock_send(server, "b", nack_data, 1);
+      } else if (size > 0 && data[0] == MSG_DELTA) {
+        size_t range_count = 0;
+        size_t changed = 0;
+        if (put_delta_frame(fbp, data + 1, size - 1, ranges, &range_count,
+                            &changed) == 0) {
+          if (range_count > 0) {
+            ssd1306_i2c_run_cmd(oled, SSD1306_I2C_CMD_POWER_ON, 0, 0);
+            display_update_delta(oled, fbp, ranges, range_count, changed);
           }
-          int idx = y * fbp->width + x;
-          ssd1306_framebuffer_put_pixel(fbp, x, y, data[idx] > 0);
-          written += 1;
+          zsock_send(server, "b", ack_data, 1);
+        } else {
+          // the framebuffer may be partially updated, the client resends a
+          // full frame after a nack
+          fprintf(stderr, "Error: invalid delta frame of %zu bytes\n", size);
+          have_frame = 0;
+          zsock_send(server, "b", nack_data, 1);
         }
+      } else {
+        fprintf(stderr, "Error: unknown message of %zu bytes\n", size);
+        zsock_send(server, "b", nack_data, 1);
       }
-      ssd1306_i2c_run_cmd(oled, SSD1306_I2C_CMD_POWER_ON, 0, 0);
-      ssd1306_i2c_display_update(oled, fbp);
-
-      byte ack_data[] = {0x61};
-      zsock_send(server, "b", ack_data, 1);
       zmsg_destroy(&msg);
 
       count = 0;
@@ -107,6 +274,7 @@ int main(void) {
 
   printf("Stopping...\n");
 
+  free(ranges);
   zpoller_destroy(&poller);
   zsock_destroy(&server);
 
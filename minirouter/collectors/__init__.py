@@ -0,0 +1,55 @@
+from importlib import import_module
+
+from .base import UNCHANGED, Collector, CollectorRuntime  # noqa: F401
+from .connectivity import ConnectivityCollector
+from .dns import DnsCollector
+from .interfaces import interfaces_collector
+from .latency import LatencyCollector
+from .throughput import ThroughputCollector
+from .wan import WanIpCollector
+
+COLLECTORS = {
+    "interfaces": interfaces_collector,
+    "connectivity": ConnectivityCollector,
+    "dns": DnsCollector,
+    "wan_ip": WanIpCollector,
+    "throughput": ThroughputCollector,
+    "latency": LatencyCollector,
+}
+
+
+def get_factory(name, options):
+    # extra collectors are plugged in with "class": "package.module:ClassName"
+    if "class" in options:
+        module_name, _, attr = options["class"].partition(":")
+        return getattr(import_module(module_name), attr)
+
+    return COLLECTORS[name]
+
+
+def load_collectors(config):
+    defaults = {
+        "interfaces": {
+            "interfaces": config.get("interfaces"),
+            "backend": config.get("interfaces_backend", "networkmanager"),
+            "resync_interval": config.get("interfaces_resync_interval", 300),
+        },
+        "connectivity": {"interval": 300},
+        "dns": {"hostname": config.get("check_dns", "google.com")},
+        "throughput": {"interval": 1, "interfaces": config.get("interfaces")},
+        # probes generate traffic of their own, only when asked for
+        "latency": {"interval": 10, "enabled": False},
+    }
+
+    sections = {name: {} for name in COLLECTORS}
+    sections.update(config.get("collectors", {}))
+
+    collectors = []
+    for name, section in sections.items():
+        options = {"interval": config["data_refresh_rate"], **defaults.get(name, {}), **section}
+        if not options.get("enabled", True):
+            continue
+
+        collectors.append(get_factory(name, options)(name, options))
+
+    return collectors
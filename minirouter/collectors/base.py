@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import threading
+
+import sdbus
+
+log = logging.getLogger(__name__)
+
+# returned by a collector to keep the last published value
+UNCHANGED = object()
+
+
+class Collector:
+    interval = 5
+    timeout = 10
+    # published when collecting fails
+    error_value = UNCHANGED
+    # status keys whose changes wake the collector up before its interval is over
+    wake_on = ()
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.interval = options.get("interval", self.interval)
+        self.timeout = options.get("timeout", self.timeout)
+        self.runtime = None
+        self._wake = None
+
+    async def collect(self):
+        raise NotImplementedError
+
+    async def run(self):
+        while True:
+            ok = await self.collect_once()
+            await self.sleep(self.next_delay(ok))
+
+    async def collect_once(self):
+        # returns whether collecting succeeded
+        ok = True
+        try:
+            value = await asyncio.wait_for(self.collect(), self.timeout)
+        except TimeoutError:
+            log.info("%s collector timed out after %ss", self.name, self.timeout)
+            value = self.error_value
+            ok = False
+        except OSError as ex:
+            # the usual failure while offline, not worth a traceback
+            log.info("%s collector failed: %s", self.name, str(ex))
+            value = self.error_value
+            ok = False
+        except Exception:
+            log.exception("error in %s collector", self.name)
+            value = self.error_value
+            ok = False
+
+        if value is not UNCHANGED:
+            self.publish(value)
+
+        return ok
+
+    def next_delay(self, ok):
+        return self.interval
+
+    async def sleep(self, delay):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except TimeoutError:
+            pass
+        self._wake.clear()
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def on_status_changed(self, key):
+        # called in the event loop for every key in wake_on
+        self.wake()
+
+    def publish(self, value):
+        self.runtime.publish(self.name, value)
+
+    def get_stats(self):
+        return None
+
+
+class CollectorRuntime:
+    # runs every collector as a task of a single event loop, in its own thread
+    def __init__(self, store):
+        self.store = store
+        self.store.subscribe(self.on_status_changed)
+        self.collectors = []
+        self.loop = None
+        self.thread = None
+        self._bus = None
+        self._stopped = None
+
+    @property
+    def bus(self):
+        if self._bus is None:
+            self._bus = sdbus.sd_bus_open_system()
+        return self._bus
+
+    def get_status(self, key):
+        return self.store.get(key)
+
+    def publish(self, key, value):
+        self.store.set(key, value)
+
+    def add(self, collector):
+        collector.runtime = self
+        self.collectors.append(collector)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    def get_stats(self):
+        stats = {}
+        for collector in self.collectors:
+            collector_stats = collector.get_stats()
+            if collector_stats is not None:
+                stats[collector.name] = collector_stats
+        return stats
+
+    def on_status_changed(self, key):
+        # the store calls it from whichever thread published the change
+        loop = self.loop
+        if loop is None:
+            return
+
+        for collector in self.collectors:
+            if key in collector.wake_on:
+                loop.call_soon_threadsafe(collector.on_status_changed, key)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+
+        tasks = [asyncio.create_task(self.run_collector(collector)) for collector in self.collectors]
+
+        await self._stopped.wait()
+
+        self.loop = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run_collector(self, collector):
+        log.debug("starting %s collector", collector.name)
+        try:
+            await collector.run()
+        except Exception:
+            log.exception("%s collector stopped", collector.name)
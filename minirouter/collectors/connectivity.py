@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+from sdbus_block.networkmanager import ConnectivityState
+
+from .interfaces import NM_INTERFACE, NM_PATH, RETRY_DELAY, UNAVAILABLE_ERRORS, NetworkManagerCollector
+
+log = logging.getLogger(__name__)
+
+
+class ConnectivityCollector(NetworkManagerCollector):
+    # Publishes NetworkManager's own connectivity check result, kept updated from its change signals. None means
+    # NetworkManager can't tell, then the wan probe checks on its own.
+    interval = 300
+    error_value = None
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        # ask NetworkManager to check again on every resync instead of using its last result
+        self.recheck = options.get("recheck", False)
+        # the collect backoff while NetworkManager can't be reached
+        self.retry_delay = None
+
+    async def run(self):
+        watcher = asyncio.create_task(self.watch())
+        try:
+            await super().run()
+        finally:
+            watcher.cancel()
+
+    async def collect(self):
+        try:
+            manager = await self.get_all(NM_PATH, NM_INTERFACE)
+        except UNAVAILABLE_ERRORS as ex:
+            self.unavailable(ex)
+            self.retry_delay = min(self.retry_delay * 2, self.interval) if self.retry_delay else RETRY_DELAY
+            return None
+
+        self.available()
+        self.retry_delay = None
+
+        if not manager.get("ConnectivityCheckAvailable", True) or not manager.get("ConnectivityCheckEnabled", True):
+            return None
+
+        state = manager["Connectivity"]
+        if self.recheck:
+            state = await self.get_proxy(NM_PATH, NM_INTERFACE).check_connectivity()
+
+        return ConnectivityState(state)
+
+    def next_delay(self, ok):
+        return self.retry_delay or self.interval
+
+    async def watch(self):
+        delay = RETRY_DELAY
+        while True:
+            try:
+                async for interface_name, changed, _ in self.get_proxy(NM_PATH).properties_changed:
+                    delay = RETRY_DELAY
+                    if interface_name != NM_INTERFACE:
+                        continue
+
+                    if changed.keys() & {"ConnectivityCheckAvailable", "ConnectivityCheckEnabled"}:
+                        self.wake()
+                    elif "Connectivity" in changed:
+                        self.publish(ConnectivityState(changed["Connectivity"][1]))
+            except UNAVAILABLE_ERRORS as ex:
+                self.unavailable(ex)
+                self.publish(None)
+            except Exception:
+                log.exception("error watching the connectivity")
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.interval)
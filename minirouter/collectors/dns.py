@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import random
+import struct
+from time import monotonic
+
+from sdbus import DbusInterfaceCommonAsync
+
+from ..records import DnsStatus, ResolverStatus
+from .base import Collector
+
+log = logging.getLogger(__name__)
+
+DNS_PORT = 53
+TYPE_A = 1
+CLASS_IN = 1
+FLAG_RD = 0x0100
+FLAG_QR = 0x8000
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+RCODE_NAMES = {1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+
+NM_SERVICE = "org.freedesktop.NetworkManager"
+DNS_MANAGER_PATH = "/org/freedesktop/NetworkManager/DnsManager"
+DNS_MANAGER_INTERFACE = "org.freedesktop.NetworkManager.DnsManager"
+
+
+class DnsManagerProxy(DbusInterfaceCommonAsync, interface_name=DNS_MANAGER_INTERFACE):
+    pass
+
+
+def build_query(query_id, hostname):
+    # the root name, "." or "", is only the terminating empty label
+    labels = [label.encode("idna") for label in hostname.split(".") if label]
+    question = b"".join(bytes([len(label)]) + label for label in labels)
+    return (
+        struct.pack("!HHHHHH", query_id, FLAG_RD, 1, 0, 0, 0) + question + b"\0" + struct.pack("!HH", TYPE_A, CLASS_IN)
+    )
+
+
+def parse_response(data):
+    # returns the (id, rcode, answer count) of a response
+    if len(data) < 12:
+        raise ValueError("truncated response")
+
+    query_id, flags, _, answers, _, _ = struct.unpack("!HHHHHH", data[:12])
+    if not flags & FLAG_QR:
+        raise ValueError("not a response")
+
+    return query_id, flags & 0xF, answers
+
+
+def parse_nameserver(value):
+    # "1.1.1.1", "127.0.0.1:5353" or an ipv6 address
+    if value.count(":") == 1:
+        host, port = value.split(":")
+        return host, int(port)
+    return value, DNS_PORT
+
+
+def read_resolv_conf(path="/etc/resolv.conf"):
+    nameservers = []
+    try:
+        with open(path) as fp:
+            for line in fp:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    nameservers.append(parts[1])
+    except OSError as ex:
+        log.info("error reading %s: %s", path, str(ex))
+    return nameservers
+
+
+class QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, query_id):
+        self.query_id = query_id
+        self.response = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        try:
+            query_id, rcode, answers = parse_response(data)
+        except ValueError:
+            return
+
+        # anything else is a late answer to an older query or spoofed
+        if query_id == self.query_id and not self.response.done():
+            self.response.set_result((rcode, answers))
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+class DnsCollector(Collector):
+    # Queries every nameserver directly and in parallel, so a broken upstream shows up after a query timeout
+    # instead of whatever the libc resolver and its cache make of it.
+    error_value = DnsStatus(False, ())
+    wake_on = ("interfaces",)
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.hostname = options.get("hostname", "google.com")
+        self.query_timeout = options.get("query_timeout", 2)
+        self.attempts = options.get("attempts", 2)
+        self.configured_nameservers = options.get("nameservers")
+        # the nameservers lookup is cached until a link changes
+        self.nameservers = None
+        self.links = None
+
+    async def collect(self):
+        if self.nameservers is None:
+            self.nameservers = await self.get_nameservers()
+            log.debug("dns nameservers: %s", self.nameservers)
+
+        if not self.nameservers:
+            return DnsStatus(False, ())
+
+        resolvers = await asyncio.gather(*[self.check_resolver(nameserver) for nameserver in self.nameservers])
+        return DnsStatus(any(resolver.ok for resolver in resolvers), tuple(resolvers))
+
+    async def get_nameservers(self):
+        if self.configured_nameservers:
+            return list(self.configured_nameservers)
+
+        try:
+            proxy = DnsManagerProxy.new_proxy(NM_SERVICE, DNS_MANAGER_PATH, self.runtime.bus)
+            properties = await proxy.properties_get_all_dict(on_unknown_member="reuse")
+            nameservers = []
+            for entry in properties["Configuration"]:
+                for nameserver in entry.get("nameservers", ("as", []))[1]:
+                    if nameserver not in nameservers:
+                        nameservers.append(nameserver)
+            if nameservers:
+                return nameservers
+        except Exception as ex:
+            log.info("error getting the nameservers from NetworkManager: %s", str(ex))
+
+        return read_resolv_conf()
+
+    async def check_resolver(self, nameserver):
+        error = None
+        for _ in range(self.attempts):
+            start = monotonic()
+            try:
+                rcode, _ = await self.query(nameserver)
+            except TimeoutError:
+                error = "timeout"
+                continue
+            except OSError as ex:
+                error = ex.strerror or str(ex)
+                continue
+
+            rtt = monotonic() - start
+            # a name that doesn't exist is still a working resolver
+            if rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                return ResolverStatus(nameserver, True, rtt, None)
+            return ResolverStatus(nameserver, False, rtt, RCODE_NAMES.get(rcode, f"rcode {rcode}"))
+
+        return ResolverStatus(nameserver, False, None, error)
+
+    async def query(self, nameserver):
+        loop = asyncio.get_running_loop()
+        query_id = random.getrandbits(16)
+
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: QueryProtocol(query_id),
+            remote_addr=parse_nameserver(nameserver),
+        )
+        try:
+            transport.sendto(build_query(query_id, self.hostname))
+            return await asyncio.wait_for(protocol.response, self.query_timeout)
+        finally:
+            transport.close()
+
+    def on_status_changed(self, key):
+        # the signal strength changes all the time, only a link going up or down or a new address may
+        # come with other nameservers, those are looked up again on the next check
+        interfaces = self.runtime.get_status("interfaces")
+        links = None
+        if interfaces is not None:
+            links = tuple((device.interface, device.state, device.ip4) for device in interfaces.devices)
+
+        if links != self.links:
+            if self.links is not None:
+                log.debug("interfaces changed, looking up the nameservers again")
+                self.nameservers = None
+            self.links = links
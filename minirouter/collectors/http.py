@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import socket
+import ssl
+from collections import deque, namedtuple
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+Response = namedtuple("Response", ["status", "headers", "body"])
+
+# responses that never have a body
+NO_BODY_STATUSES = {204, 304}
+
+
+class HttpSession:
+    # A minimal HTTP/1.1 client that keeps the connections alive between requests, so the periodic probes
+    # don't pay for a TCP and TLS handshake every time.
+    def __init__(self, connect_timeout=5, read_timeout=10):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.ssl_context = None
+        # (scheme, host, port) -> idle (reader, writer) pairs
+        self.pool = {}
+        self.handshakes = 0
+        self.requests = 0
+
+    async def get(self, url, headers=None):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        request_headers = {"Host": parts.netloc, "User-Agent": "minirouter", "Connection": "keep-alive"}
+        request_headers.update(headers or {})
+        request = f"GET {path} HTTP/1.1\r\n"
+        request += "".join(f"{name}: {value}\r\n" for name, value in request_headers.items())
+        request = f"{request}\r\n".encode("latin-1")
+
+        self.requests += 1
+
+        while True:
+            connection = self.take_idle(key)
+            reused = connection is not None
+            if connection is None:
+                connection = await self.connect(key)
+
+            try:
+                response, keep_alive = await asyncio.wait_for(self.send(connection, request), self.read_timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close(connection)
+                # the server may have dropped an idle connection, that's worth a retry on a fresh one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                self.close(connection)
+                raise
+
+            if keep_alive:
+                self.pool.setdefault(key, []).append(connection)
+            else:
+                self.close(connection)
+
+            return response
+
+    def take_idle(self, key):
+        idle = self.pool.get(key)
+        while idle:
+            reader, writer = connection = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return connection
+            self.close(connection)
+        return None
+
+    async def connect(self, key):
+        scheme, host, port = key
+
+        ssl_context = None
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            ssl_context = self.ssl_context
+
+        connection = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context, family=socket.AF_INET),
+            self.connect_timeout,
+        )
+        self.handshakes += 1
+        return connection
+
+    async def send(self, connection, request):
+        reader, writer = connection
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by the server")
+        version, status = status_line.split()[:2]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise asyncio.IncompleteReadError(b"", None)
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        if status in NO_BODY_STATUSES:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # skip the trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return Response(status, headers, body), keep_alive
+
+    def close(self, connection):
+        connection[1].close()
+
+    def close_all(self):
+        for connections in self.pool.values():
+            for connection in connections:
+                self.close(connection)
+        self.pool.clear()
+
+
+class LatencyStats:
+    def __init__(self, window=20):
+        self.count = 0
+        self.total = 0
+        self.last = None
+        self.max = 0
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    @property
+    def p50(self):
+        # median of the recent samples, None until there is one
+        if not self.samples:
+            return None
+        return sorted(self.samples)[len(self.samples) // 2]
+
+    def get_stats(self):
+        return {
+            "count": self.count,
+            "last_ms": None if self.last is None else round(self.last * 1000, 1),
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else None,
+            "p50_ms": None if self.p50 is None else round(self.p50 * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+
+from sdbus import DbusInterfaceCommonAsync, SdBusLibraryError, dbus_method_async
+from sdbus.dbus_exceptions import DbusServiceUnknownError
+from sdbus_block.networkmanager import DeviceState, DeviceType
+
+from ..records import InterfaceInfo, Interfaces
+from .base import Collector
+
+log = logging.getLogger(__name__)
+
+NM_SERVICE = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+
+NM_INTERFACE = "org.freedesktop.NetworkManager"
+DEVICE_INTERFACE = "org.freedesktop.NetworkManager.Device"
+WIRELESS_INTERFACE = "org.freedesktop.NetworkManager.Device.Wireless"
+IP4_CONFIG_INTERFACE = "org.freedesktop.NetworkManager.IP4Config"
+ACCESS_POINT_INTERFACE = "org.freedesktop.NetworkManager.AccessPoint"
+
+NO_OBJECT = "/"
+
+RETRY_DELAY = 5
+
+# raised when there is no system bus or NetworkManager isn't running
+UNAVAILABLE_ERRORS = (SdBusLibraryError, DbusServiceUnknownError)
+
+
+# The async NetworkManager bindings can't be imported in the same process as the blocking ones (both register the
+# same D-Bus errors), so the interfaces are declared here with only what is used, their properties are read as a dict.
+class NetworkManagerProxy(DbusInterfaceCommonAsync, interface_name=NM_INTERFACE):
+    @dbus_method_async(result_signature="u")
+    async def check_connectivity(self) -> int:
+        raise NotImplementedError
+
+
+class DeviceProxy(DbusInterfaceCommonAsync, interface_name=DEVICE_INTERFACE):
+    pass
+
+
+class WirelessProxy(DbusInterfaceCommonAsync, interface_name=WIRELESS_INTERFACE):
+    pass
+
+
+class Ip4ConfigProxy(DbusInterfaceCommonAsync, interface_name=IP4_CONFIG_INTERFACE):
+    pass
+
+
+class AccessPointProxy(DbusInterfaceCommonAsync, interface_name=ACCESS_POINT_INTERFACE):
+    pass
+
+
+PROXIES = {
+    NM_INTERFACE: NetworkManagerProxy,
+    DEVICE_INTERFACE: DeviceProxy,
+    WIRELESS_INTERFACE: WirelessProxy,
+    IP4_CONFIG_INTERFACE: Ip4ConfigProxy,
+    ACCESS_POINT_INTERFACE: AccessPointProxy,
+}
+
+
+def format_ip4(address_data):
+    if not address_data:
+        return "-"
+
+    ipa = address_data[0]
+    return f"{ipa['address'][1]}/{ipa['prefix'][1]}"
+
+
+class NetworkManagerCollector(Collector):
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.interfaces = options.get("interfaces")
+        self.dbus_calls = 0
+        # whether NetworkManager or the bus can't be reached
+        self.missing = False
+
+    def unavailable(self, ex):
+        # the usual state on a machine without NetworkManager, not worth more than a line
+        if not self.missing:
+            log.info("NetworkManager not available for the %s collector: %s", self.name, str(ex))
+            self.missing = True
+
+    def available(self):
+        if self.missing:
+            log.info("NetworkManager is available again for the %s collector", self.name)
+            self.missing = False
+
+    def get_proxy(self, path, interface_name=None):
+        proxy_class = PROXIES[interface_name] if interface_name is not None else DbusInterfaceCommonAsync
+        return proxy_class.new_proxy(NM_SERVICE, path, self.runtime.bus)
+
+    async def get_all(self, path, interface_name):
+        # a single GetAll call, with the properties by their D-Bus names
+        self.dbus_calls += 1
+        return await self.get_proxy(path, interface_name).properties_get_all_dict(on_unknown_member="reuse")
+
+
+class InterfacesPoller(NetworkManagerCollector):
+    # Reads the interfaces status every interval, each object is read with a single GetAll call and the
+    # properties that never change for a device are cached, so filtered out devices cost nothing.
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        # device path -> (interface name, device type)
+        self.static_properties = {}
+
+    async def collect(self):
+        return await self.get_interfaces()
+
+    async def get_static_properties(self, path):
+        static = self.static_properties.get(path)
+        if static is None:
+            device = await self.get_all(path, DEVICE_INTERFACE)
+            static = (device["Interface"], DeviceType(device["DeviceType"]))
+            self.static_properties[path] = static
+        return static
+
+    async def get_interfaces(self):
+        self.dbus_calls = 0
+        devices = []
+        wifi = None
+
+        paths = (await self.get_all(NM_PATH, NM_INTERFACE))["Devices"]
+
+        # removed devices paths are never reused, forget about them
+        for path in self.static_properties.keys() - set(paths):
+            del self.static_properties[path]
+
+        for path, (interface, device_type) in sorted(
+            [(path, await self.get_static_properties(path)) for path in paths], key=lambda item: item[1][0]
+        ):
+            if self.interfaces and interface not in self.interfaces:
+                continue
+
+            device = await self.get_all(path, DEVICE_INTERFACE)
+            state = DeviceState(device["State"])
+
+            info = {
+                "interface": interface,
+                "state": state,
+                "ip4": "-",
+                "type": device_type,
+                "ssid": "-",
+            }
+
+            if state is DeviceState.ACTIVATED:
+                try:
+                    if device["Ip4Config"] != NO_OBJECT:
+                        ip4 = await self.get_all(device["Ip4Config"], IP4_CONFIG_INTERFACE)
+                        info["ip4"] = format_ip4(ip4["AddressData"])
+                except Exception as ex:
+                    log.info("error getting ip: %s", str(ex))
+                    info["ip4"] = "E"
+
+                try:
+                    if device_type is DeviceType.WIFI:
+                        wifi = interface
+
+                        ap_path = (await self.get_all(path, WIRELESS_INTERFACE))["ActiveAccessPoint"]
+                        if ap_path != NO_OBJECT:
+                            ap = await self.get_all(ap_path, ACCESS_POINT_INTERFACE)
+                            info["ssid"] = bytes(ap["Ssid"]).decode()
+                            info["strength"] = ap["Strength"]
+                        else:
+                            info["ssid"] = None
+                            info["strength"] = None
+                except Exception as ex:
+                    log.info("error getting ssid: %s", str(ex))
+                    info["ssid"] = "* error *"
+
+            devices.append(InterfaceInfo(**info))
+
+        log.debug("interfaces refresh made %d D-Bus calls", self.dbus_calls)
+
+        return Interfaces(tuple(devices), wifi)
+
+
+class InterfacesWatcher(NetworkManagerCollector):
+    # keeps the interfaces status updated from NetworkManager signals, with a slow full resync as a safety net
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.resync_interval = options.get("resync_interval", 300)
+        self.resync_requested = None
+        # device path -> device info
+        self.devices = {}
+        # device path -> paths of the objects the device info depends on
+        self.dependencies = {}
+        # watched object path -> signal watching task
+        self.watchers = {}
+        self.refreshes = set()
+
+    async def run(self):
+        self.resync_requested = asyncio.Event()
+        retry_delay = None
+
+        while True:
+            timeout = self.resync_interval
+            try:
+                await self.resync()
+                self.available()
+                retry_delay = None
+            except UNAVAILABLE_ERRORS as ex:
+                self.unavailable(ex)
+                retry_delay = min(retry_delay * 2, self.resync_interval) if retry_delay else RETRY_DELAY
+                timeout = retry_delay
+            except Exception:
+                log.exception("error syncing interfaces")
+                timeout = RETRY_DELAY
+
+            try:
+                await asyncio.wait_for(self.resync_requested.wait(), timeout)
+            except TimeoutError:
+                pass
+            self.resync_requested.clear()
+
+    async def resync(self):
+        manager = await self.get_all(NM_PATH, NM_INTERFACE)
+
+        devices = {}
+        for path in manager["Devices"]:
+            info = await self.fetch_device(path)
+            if info is not None:
+                devices[path] = info
+
+        self.devices = devices
+        self.sync_watchers()
+        self.publish_devices()
+
+    async def refresh_device(self, path):
+        try:
+            info = await self.fetch_device(path)
+        except Exception as ex:
+            log.info("error refreshing device %s: %s", path, str(ex))
+            self.resync_requested.set()
+            return
+
+        if info is None:
+            self.devices.pop(path, None)
+        else:
+            self.devices[path] = info
+
+        self.sync_watchers()
+        self.publish_devices()
+
+    async def fetch_device(self, path):
+        device = await self.get_all(path, DEVICE_INTERFACE)
+
+        if self.interfaces and device["Interface"] not in self.interfaces:
+            return None
+
+        device_type = DeviceType(device["DeviceType"])
+        state = DeviceState(device["State"])
+
+        info = {
+            "interface": device["Interface"],
+            "state": state,
+            "ip4": "-",
+            "type": device_type,
+            "ssid": "-",
+        }
+        dependencies = {}
+
+        if state is DeviceState.ACTIVATED:
+            ip4_path = device["Ip4Config"]
+            if ip4_path != NO_OBJECT:
+                dependencies["ip4"] = ip4_path
+                try:
+                    ip4 = await self.get_all(ip4_path, IP4_CONFIG_INTERFACE)
+                    info["ip4"] = format_ip4(ip4["AddressData"])
+                except Exception as ex:
+                    log.info("error getting ip: %s", str(ex))
+                    info["ip4"] = "E"
+
+            if device_type is DeviceType.WIFI:
+                try:
+                    wireless = await self.get_all(path, WIRELESS_INTERFACE)
+                    ap_path = wireless["ActiveAccessPoint"]
+                    if ap_path != NO_OBJECT:
+                        dependencies["ap"] = ap_path
+                        ap = await self.get_all(ap_path, ACCESS_POINT_INTERFACE)
+                        info["ssid"] = bytes(ap["Ssid"]).decode()
+                        info["strength"] = ap["Strength"]
+                    else:
+                        info["ssid"] = None
+                        info["strength"] = None
+                except Exception as ex:
+                    log.info("error getting ssid: %s", str(ex))
+                    info["ssid"] = "* error *"
+
+        self.dependencies[path] = dependencies
+
+        return info
+
+    def sync_watchers(self):
+        wanted = {NM_PATH: None}
+        for path in self.devices:
+            wanted[path] = path
+            for dependency in self.dependencies.get(path, {}).values():
+                wanted[dependency] = path
+
+        for path in list(self.watchers):
+            if path not in wanted:
+                self.watchers.pop(path).cancel()
+
+        for path, device_path in wanted.items():
+            if path not in self.watchers:
+                self.watchers[path] = asyncio.create_task(self.watch(path, device_path))
+
+    async def watch(self, path, device_path):
+        try:
+            proxy = self.get_proxy(path)
+            async for interface_name, changed, _ in proxy.properties_changed:
+                self.on_properties_changed(path, device_path, interface_name, changed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("error watching %s", path)
+            self.watchers.pop(path, None)
+            self.resync_requested.set()
+
+    def on_properties_changed(self, path, device_path, interface_name, changed):
+        if device_path is None:
+            if interface_name == NM_INTERFACE and "Devices" in changed:
+                self.resync_requested.set()
+            return
+
+        info = self.devices.get(device_path)
+        if info is None:
+            return
+
+        if interface_name == ACCESS_POINT_INTERFACE:
+            # the signal carries the new values, no need for another round trip
+            if "Strength" in changed:
+                info["strength"] = changed["Strength"][1]
+            if "Ssid" in changed:
+                info["ssid"] = bytes(changed["Ssid"][1]).decode()
+            self.publish_devices()
+        elif (
+            (interface_name == DEVICE_INTERFACE and changed.keys() & {"State", "Ip4Config"})
+            or (interface_name == WIRELESS_INTERFACE and "ActiveAccessPoint" in changed)
+            or (interface_name == IP4_CONFIG_INTERFACE and "AddressData" in changed)
+        ):
+            task = asyncio.create_task(self.refresh_device(device_path))
+            self.refreshes.add(task)
+            task.add_done_callback(self.refreshes.discard)
+
+    def publish_devices(self):
+        devices = []
+        wifi = None
+
+        for info in sorted(self.devices.values(), key=lambda item: item["interface"]):
+            devices.append(InterfaceInfo(**info))
+            if info["type"] is DeviceType.WIFI and info["state"] is DeviceState.ACTIVATED:
+                wifi = info["interface"]
+
+        self.publish(Interfaces(tuple(devices), wifi))
+
+
+def interfaces_collector(name, options):
+    backend = options.get("backend", "networkmanager")
+    if backend == "polling":
+        return InterfacesPoller(name, options)
+    if backend == "netlink":
+        from .netlink import NetlinkInterfacesCollector
+
+        return NetlinkInterfacesCollector(name, options)
+    return InterfacesWatcher(name, options)
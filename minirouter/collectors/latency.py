@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import random
+import socket
+import struct
+from array import array
+from collections import deque
+from time import monotonic
+
+from ..records import LatencyStatus
+from .base import Collector
+from .dns import build_query
+
+log = logging.getLogger(__name__)
+
+# upper edges of the histogram buckets in milliseconds, the last one catches everything slower
+BUCKETS = (1, 2, 3, 5, 7, 10, 15, 20, 30, 40, 50, 70, 100, 150, 200, 300, 500, 700, 1000, 2000, float("inf"))
+LOST = -1
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+class Histogram:
+    # Fixed bucket RTT histogram over a sliding window of probes, the counts are updated incrementally as
+    # probes enter and leave the window.
+    def __init__(self, window):
+        self.counts = array("I", bytes(4 * len(BUCKETS)))
+        self.window = deque(maxlen=window)
+        self.lost = 0
+        self.jitter = 0.0
+        self.last_rtt = None
+
+    def add(self, rtt):
+        if len(self.window) == self.window.maxlen:
+            evicted = self.window[0]
+            if evicted == LOST:
+                self.lost -= 1
+            else:
+                self.counts[evicted] -= 1
+
+        if rtt is None:
+            self.window.append(LOST)
+            self.lost += 1
+            return
+
+        for bucket, edge in enumerate(BUCKETS):
+            if rtt <= edge:
+                break
+        self.window.append(bucket)
+        self.counts[bucket] += 1
+
+        # smoothed the same way as the RFC 3550 interarrival jitter
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+
+    def percentile(self, fraction):
+        answered = len(self.window) - self.lost
+        if not answered:
+            return None
+
+        rank = fraction * answered
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[bucket - 1] if bucket else 0
+                upper = BUCKETS[bucket]
+                if upper == float("inf"):
+                    return lower
+                # assumes the samples are evenly spread inside the bucket
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+
+        return BUCKETS[-2]
+
+    def get_status(self, target):
+        probes = len(self.window)
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return LatencyStatus(
+            target=target,
+            p50=None if p50 is None else round(p50, 1),
+            p95=None if p95 is None else round(p95, 1),
+            jitter=round(self.jitter, 1),
+            loss=self.lost / probes if probes else None,
+            probes=probes,
+        )
+
+
+def parse_target(value):
+    # "tcp:host:port", "udp:host:port" or "icmp:host"
+    kind, _, rest = value.partition(":")
+    if kind == "icmp":
+        return kind, rest, None
+
+    host, _, port = rest.rpartition(":")
+    return kind, host, int(port)
+
+
+class Target:
+    def __init__(self, spec, window):
+        self.spec = spec
+        self.kind, self.host, self.port = parse_target(spec)
+        self.histogram = Histogram(window)
+        self.disabled = False
+
+    async def probe(self, timeout):
+        # returns the rtt in milliseconds, None when lost
+        start = monotonic()
+        try:
+            await asyncio.wait_for(getattr(self, f"probe_{self.kind}")(), timeout)
+        except TimeoutError:
+            return None
+        except ConnectionRefusedError:
+            # a reset or port unreachable still made the round trip
+            pass
+        except PermissionError as ex:
+            log.info("%s probes aren't permitted, disabling %s: %s", self.kind, self.spec, str(ex))
+            self.disabled = True
+            return None
+        except OSError as ex:
+            log.debug("probe to %s failed: %s", self.spec, str(ex))
+            return None
+
+        return (monotonic() - start) * 1000
+
+    async def probe_tcp(self):
+        _, writer = await asyncio.open_connection(self.host, self.port, family=socket.AF_INET)
+        writer.close()
+
+    async def probe_udp(self):
+        # a dns query gets an answer from resolvers, a closed port answers with a port unreachable
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: UdpProbeProtocol(), remote_addr=(self.host, self.port), family=socket.AF_INET
+        )
+        try:
+            transport.sendto(build_query(random.getrandbits(16), "."))
+            await protocol.answer
+        finally:
+            transport.close()
+
+    async def probe_icmp(self):
+        loop = asyncio.get_running_loop()
+        address = (await loop.getaddrinfo(self.host, None, family=socket.AF_INET))[0][4][0]
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP) as sock:
+            sock.setblocking(False)
+            sock.connect((address, 0))
+
+            # the kernel replaces the identifier with the socket's own and fills in the checksum
+            seq = random.getrandbits(16)
+            packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, 0, seq) + b"minirouter"
+            await loop.sock_sendall(sock, packet)
+
+            while True:
+                data = await loop.sock_recv(sock, 1024)
+                kind, _, _, _, reply_seq = struct.unpack_from("!BBHHH", data)
+                if kind == ICMP_ECHO_REPLY and reply_seq == seq:
+                    return
+
+
+class UdpProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.answer = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.answer.done():
+            self.answer.set_result(data)
+
+    def error_received(self, exc):
+        if not self.answer.done():
+            self.answer.set_exception(exc)
+
+
+class LatencyCollector(Collector):
+    # Every interval each target gets a few probes, their rtts go into a histogram over the last window probes
+    # and the p50, p95, jitter and loss are published.
+    interval = 10
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.targets = [Target(spec, options.get("window", 60)) for spec in options.get("targets", ["tcp:1.1.1.1:443"])]
+        self.count = options.get("count", 3)
+        self.spacing = options.get("spacing", 0.2)
+        self.probe_timeout = options.get("probe_timeout", 1)
+
+    async def collect(self):
+        await asyncio.gather(*[self.probe_target(target) for target in self.targets if not target.disabled])
+        return tuple(target.histogram.get_status(target.spec) for target in self.targets if not target.disabled)
+
+    async def probe_target(self, target):
+        for idx in range(self.count):
+            if idx:
+                await asyncio.sleep(self.spacing)
+            rtt = await target.probe(self.probe_timeout)
+            if target.disabled:
+                return
+            target.histogram.add(rtt)
+
+    def get_stats(self):
+        return {target.spec: list(target.histogram.counts) for target in self.targets}
@@ -0,0 +1,274 @@
+import asyncio
+import errno
+import logging
+import os
+import socket
+import struct
+from collections import namedtuple
+
+from sdbus_block.networkmanager import DeviceState, DeviceType
+
+from ..records import InterfaceInfo, Interfaces
+from .base import Collector
+
+log = logging.getLogger(__name__)
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_F_SECONDARY = 0x1
+
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+IF_OPER_UNKNOWN = 0
+IF_OPER_UP = 6
+
+ARPHRD_ETHER = 1
+ARPHRD_LOOPBACK = 772
+
+NLMSGHDR = struct.Struct("=IHHII")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+RTATTR = struct.Struct("=HH")
+
+RESYNC_DELAY = 5
+
+Link = namedtuple("Link", "name type state")
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def parse_attributes(data):
+    attributes = {}
+    offset = 0
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attributes[kind] = data[offset + RTATTR.size : offset + length]
+        offset += align(length)
+    return attributes
+
+
+def parse_messages(data):
+    # yields the (type, flags, seq, payload) of every message in a datagram
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, kind, flags, seq, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        yield kind, flags, seq, data[offset + NLMSGHDR.size : offset + length]
+        offset += align(length)
+
+
+def link_state(flags, operstate):
+    if operstate == IF_OPER_UP or (operstate == IF_OPER_UNKNOWN and flags & IFF_UP and flags & IFF_RUNNING):
+        return DeviceState.ACTIVATED
+    if flags & IFF_UP:
+        return DeviceState.DISCONNECTED
+    return DeviceState.UNAVAILABLE
+
+
+def link_type(name, arphrd):
+    if os.path.exists(f"/sys/class/net/{name}/wireless"):
+        return DeviceType.WIFI
+    if arphrd == ARPHRD_ETHER:
+        return DeviceType.ETHERNET
+    if arphrd == ARPHRD_LOOPBACK:
+        return DeviceType.LOOPBACK
+    return DeviceType.GENERIC
+
+
+class NetlinkInterfacesCollector(Collector):
+    # Keeps an interface table updated straight from the kernel link and ipv4 address events, without going
+    # through NetworkManager. The wifi ssid and signal aren't available this way.
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.interfaces = options.get("interfaces")
+        self.resync_interval = options.get("resync_interval", 300)
+        self.sock = None
+        # ifindex -> Link
+        self.links = {}
+        # ifindex -> {(address, prefix): secondary}
+        self.addresses = {}
+        self.seq = 0
+        self.dump_waiter = None
+        self.resync_requested = None
+        self.events = 0
+
+    async def run(self):
+        self.resync_requested = asyncio.Event()
+
+        while True:
+            try:
+                await self.monitor()
+            except Exception:
+                log.exception("error monitoring the interfaces")
+            finally:
+                self.close()
+            await asyncio.sleep(RESYNC_DELAY)
+
+    async def monitor(self):
+        loop = asyncio.get_running_loop()
+
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK, socket.NETLINK_ROUTE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 18)
+        self.sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        loop.add_reader(self.sock.fileno(), self.on_readable)
+
+        while True:
+            # the events that arrive during the dumps just update the fresh tables
+            self.links = {}
+            self.addresses = {}
+            await self.dump(RTM_GETLINK, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+            await self.dump(RTM_GETADDR, IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0))
+            self.publish_interfaces()
+
+            try:
+                await asyncio.wait_for(self.resync_requested.wait(), self.resync_interval)
+            except TimeoutError:
+                pass
+            self.resync_requested.clear()
+
+    async def dump(self, kind, payload):
+        self.seq += 1
+        self.dump_waiter = (self.seq, asyncio.get_running_loop().create_future())
+
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), kind, NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+        self.sock.send(header + payload)
+
+        try:
+            await asyncio.wait_for(self.dump_waiter[1], self.timeout)
+        finally:
+            self.dump_waiter = None
+
+    def close(self):
+        if self.sock is not None:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def on_readable(self):
+        changed = False
+        while True:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                break
+            except OSError as ex:
+                if ex.errno == errno.ENOBUFS:
+                    # events were lost, only a new dump can tell the current state
+                    log.info("netlink events overflowed, resyncing")
+                    self.resync_requested.set()
+                    continue
+                raise
+
+            for kind, flags, seq, payload in parse_messages(data):
+                changed |= self.handle_message(kind, seq, payload)
+
+        # a burst of events is published once
+        if changed and self.dump_waiter is None:
+            self.publish_interfaces()
+
+    def handle_message(self, kind, seq, payload):
+        if kind in (NLMSG_DONE, NLMSG_ERROR):
+            if self.dump_waiter is not None and seq == self.dump_waiter[0]:
+                waiter = self.dump_waiter[1]
+                # the dump may have timed out or been cancelled already
+                if waiter.done():
+                    return False
+
+                error = struct.unpack_from("=i", payload)[0] if kind == NLMSG_ERROR else 0
+                if error != 0:
+                    waiter.set_exception(OSError(-error, "netlink dump failed"))
+                else:
+                    waiter.set_result(None)
+            return False
+
+        self.events += 1
+
+        if kind in (RTM_NEWLINK, RTM_DELLINK):
+            _, arphrd, index, flags, _ = IFINFOMSG.unpack_from(payload)
+            attributes = parse_attributes(payload[IFINFOMSG.size :])
+
+            if kind == RTM_DELLINK:
+                self.links.pop(index, None)
+                self.addresses.pop(index, None)
+                return True
+
+            name = attributes.get(IFLA_IFNAME, b"").rstrip(b"\0").decode()
+            operstate = attributes.get(IFLA_OPERSTATE, b"\0")[0]
+            self.links[index] = Link(name, link_type(name, arphrd), link_state(flags, operstate))
+            return True
+
+        if kind in (RTM_NEWADDR, RTM_DELADDR):
+            family, prefix, flags, _, index = IFADDRMSG.unpack_from(payload)
+            if family != socket.AF_INET:
+                return False
+
+            attributes = parse_attributes(payload[IFADDRMSG.size :])
+            address = attributes.get(IFA_LOCAL) or attributes.get(IFA_ADDRESS)
+            if address is None:
+                return False
+
+            key = (socket.inet_ntop(socket.AF_INET, address), prefix)
+            if kind == RTM_DELADDR:
+                self.addresses.get(index, {}).pop(key, None)
+            else:
+                self.addresses.setdefault(index, {})[key] = bool(flags & IFA_F_SECONDARY)
+            return True
+
+        return False
+
+    def format_ip4(self, index):
+        addresses = self.addresses.get(index)
+        if not addresses:
+            return "-"
+
+        # primary addresses first, in the order the kernel reported them
+        address, prefix = min(addresses, key=lambda key: addresses[key])
+        return f"{address}/{prefix}"
+
+    def publish_interfaces(self):
+        devices = []
+        wifi = None
+
+        for index, link in sorted(self.links.items(), key=lambda item: item[1].name):
+            if self.interfaces and link.name not in self.interfaces:
+                continue
+
+            activated = link.state is DeviceState.ACTIVATED
+            devices.append(
+                InterfaceInfo(
+                    interface=link.name,
+                    state=link.state,
+                    ip4=self.format_ip4(index) if activated else "-",
+                    type=link.type,
+                    ssid=None if link.type is DeviceType.WIFI else "-",
+                )
+            )
+            if link.type is DeviceType.WIFI and activated:
+                wifi = link.name
+
+        self.publish(Interfaces(tuple(devices), wifi))
+
+    def get_stats(self):
+        return {"events": self.events, "links": len(self.links)}
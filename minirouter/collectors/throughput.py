@@ -0,0 +1,131 @@
+import logging
+import os
+from array import array
+from time import monotonic
+
+from ..records import InterfaceThroughput
+from .base import Collector
+
+log = logging.getLogger(__name__)
+
+SYS_CLASS_NET = "/sys/class/net"
+MAX_RATE = 2**32 - 1
+
+
+class RingBuffer:
+    # fixed size history of unsigned ints, preallocated so sampling never allocates
+    def __init__(self, size, typecode="I"):
+        self.data = array(typecode, bytes(array(typecode).itemsize * size))
+        self.pos = 0
+
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.data)
+
+    def extend(self, values):
+        for value in values[-len(self.data) :]:
+            self.append(value)
+
+    def last(self):
+        return self.data[self.pos - 1]
+
+    def snapshot(self):
+        return self.data[self.pos :] + self.data[: self.pos]
+
+
+class Counter:
+    # a statistics file kept open, read with pread from the start every time
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def read(self):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+
+        try:
+            return int(os.pread(self.fd, 32, 0))
+        except OSError:
+            # the interface is gone, it will be reopened if it comes back
+            self.close()
+            raise
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class InterfaceSampler:
+    def __init__(self, interface, history):
+        self.interface = interface
+        statistics = f"{SYS_CLASS_NET}/{interface}/statistics"
+        self.counters = (Counter(f"{statistics}/rx_bytes"), Counter(f"{statistics}/tx_bytes"))
+        self.rings = (RingBuffer(history), RingBuffer(history))
+        self.last_values = None
+        self.last_time = None
+
+    def sample(self, now):
+        try:
+            values = [counter.read() for counter in self.counters]
+        except (OSError, ValueError):
+            values = None
+
+        for idx, ring in enumerate(self.rings):
+            rate = 0
+            if values is not None and self.last_values is not None:
+                # a counter that went backwards was reset with the interface
+                delta = max(0, values[idx] - self.last_values[idx])
+                rate = min(MAX_RATE, int(delta / (now - self.last_time)))
+            ring.append(rate)
+
+        self.last_values = values
+        self.last_time = now
+
+    def get_throughput(self):
+        rx, tx = self.rings
+        return InterfaceThroughput(self.interface, rx.last(), tx.last(), rx.snapshot(), tx.snapshot())
+
+    def close(self):
+        for counter in self.counters:
+            counter.close()
+
+
+class ThroughputCollector(Collector):
+    interval = 1
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.history = options.get("history", 128)
+        interfaces = options.get("interfaces")
+        if not interfaces:
+            interfaces = sorted(interface for interface in os.listdir(SYS_CLASS_NET) if interface != "lo")
+        self.samplers = [InterfaceSampler(interface, self.history) for interface in interfaces]
+        self.seeded = False
+
+    async def run(self):
+        try:
+            await super().run()
+        finally:
+            for sampler in self.samplers:
+                sampler.close()
+
+    def seed(self):
+        # continues the graphs restored from the history file
+        previous = {item.interface: item for item in self.runtime.get_status("throughput") or ()}
+        for sampler in self.samplers:
+            item = previous.get(sampler.interface)
+            if item is not None:
+                sampler.rings[0].extend(item.rx_history)
+                sampler.rings[1].extend(item.tx_history)
+
+    async def collect(self):
+        if not self.seeded:
+            self.seeded = True
+            self.seed()
+
+        now = monotonic()
+        for sampler in self.samplers:
+            sampler.sample(now)
+
+        return tuple(sampler.get_throughput() for sampler in self.samplers)
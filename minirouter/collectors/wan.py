@@ -0,0 +1,221 @@
+import asyncio
+import ipaddress
+import logging
+import random
+from time import monotonic
+
+from sdbus_block.networkmanager import ConnectivityState
+
+from .base import Collector
+from .http import HttpSession, LatencyStats
+
+log = logging.getLogger(__name__)
+
+DEFAULT_IP_URLS = ["https://share.us.davidrios.dev/myip"]
+DEFAULT_ONLINE_URLS = ["http://1.1.1.1"]
+
+
+class InvalidAnswer(OSError):
+    # an answer that isn't the expected one, like a captive portal page, fails the probe like a network error
+    pass
+
+
+class Endpoint:
+    def __init__(self, url, order):
+        self.url = url
+        # position in the config, breaks the ties between endpoints without measurements
+        self.order = order
+        self.latency = LatencyStats()
+        self.failures = 0
+        # validators and cached value for the conditional requests
+        self.validators = None
+        self.cached = None
+
+    def get_stats(self):
+        return {"failures": self.failures, **self.latency.get_stats()}
+
+
+class WanIpCollector(Collector):
+    # Every probe goes through a list of endpoints, fastest first. The next endpoint is only tried when the
+    # previous ones haven't answered within a delay derived from their median latency, and the first valid
+    # answer cancels the others.
+    error_value = "-error-"
+    wake_on = ("interfaces", "connectivity")
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.ip_endpoints = [Endpoint(url, idx) for idx, url in enumerate(options.get("ip_urls", DEFAULT_IP_URLS))]
+        self.online_endpoints = [
+            Endpoint(url, idx) for idx, url in enumerate(options.get("online_urls", DEFAULT_ONLINE_URLS))
+        ]
+        # a probe needs at least one endpoint to race
+        if not self.ip_endpoints or not self.online_endpoints:
+            raise ValueError(f"{name} needs at least one url in ip_urls and online_urls")
+        self.max_backoff = options.get("max_backoff", 300)
+        self.hedge_factor = options.get("hedge_factor", 2)
+        self.hedge_delay = options.get("hedge_delay", 1)
+        self.min_hedge_delay = options.get("min_hedge_delay", 0.05)
+        self.session = HttpSession(
+            connect_timeout=options.get("connect_timeout", 5),
+            read_timeout=options.get("read_timeout", 10),
+        )
+        self.latency = LatencyStats()
+        self.hedged = 0
+        self.skipped = 0
+        self.failures = 0
+        self.links = None
+
+    async def collect(self):
+        # without dns only plain reachability can be checked
+        dns = self.runtime.get_status("dns")
+        is_ip = dns is not None and dns.ok
+
+        # when NetworkManager already knows whether we're online, only the public ip is worth a request
+        connectivity = self.runtime.get_status("connectivity")
+        if connectivity is not None and connectivity is not ConnectivityState.UNKNOWN:
+            if connectivity is not ConnectivityState.FULL:
+                self.skipped += 1
+                return None
+            if not is_ip:
+                self.skipped += 1
+                return "online"
+
+        endpoints = self.ip_endpoints if is_ip else self.online_endpoints
+
+        start = monotonic()
+        value = await self.probe_hedged(endpoints, is_ip)
+        self.latency.add(monotonic() - start)
+
+        return value
+
+    async def probe_hedged(self, endpoints, is_ip):
+        ordered = sorted(endpoints, key=self.sort_key)
+        pending = set()
+        error = None
+
+        try:
+            for idx, endpoint in enumerate(ordered):
+                if idx > 0:
+                    self.hedged += 1
+                pending.add(asyncio.create_task(self.probe(endpoint, is_ip)))
+
+                # the last endpoint has nothing left to hedge with
+                timeout = self.get_hedge_delay(endpoint) if idx < len(ordered) - 1 else None
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break
+
+                    for task in done:
+                        try:
+                            return task.result()
+                        except Exception as ex:
+                            error = ex
+
+                    # a failed answer doesn't need to wait for the hedge delay
+                    if idx < len(ordered) - 1:
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
+    def sort_key(self, endpoint):
+        # endpoints without measurements are assumed to answer within the default hedge delay
+        p50 = endpoint.latency.p50
+        return (self.hedge_delay if p50 is None else p50, endpoint.order)
+
+    def get_hedge_delay(self, endpoint):
+        p50 = endpoint.latency.p50
+        if p50 is None:
+            return self.hedge_delay
+        return max(self.min_hedge_delay, p50 * self.hedge_factor)
+
+    async def probe(self, endpoint, is_ip):
+        headers = endpoint.validators or {}
+
+        start = monotonic()
+        try:
+            res = await self.session.get(endpoint.url, headers=headers)
+            value = self.parse(endpoint, res, is_ip)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            endpoint.failures += 1
+            # counts as slow so the endpoint sinks in the ordering
+            endpoint.latency.add(self.session.read_timeout)
+            log.debug("%s failed: %s", endpoint.url, str(ex))
+            raise
+
+        endpoint.latency.add(monotonic() - start)
+        return value
+
+    def parse(self, endpoint, res, is_ip):
+        if res.status == 304 and endpoint.cached is not None:
+            return endpoint.cached
+
+        if not is_ip:
+            # any answer proves the uplink works, 1.1.1.1 itself only redirects to https
+            if res.status >= 400:
+                raise InvalidAnswer(f"status {res.status}")
+            return "online"
+
+        if res.status != 200:
+            raise InvalidAnswer(f"status {res.status}")
+
+        value = res.body.decode().strip()
+        try:
+            ipaddress.ip_address(value)
+        except ValueError:
+            raise InvalidAnswer(f"not an ip address: {value[:40]!r}") from None
+
+        validators = {}
+        if "etag" in res.headers:
+            validators["If-None-Match"] = res.headers["etag"]
+        if "last-modified" in res.headers:
+            validators["If-Modified-Since"] = res.headers["last-modified"]
+        endpoint.validators = validators or None
+        endpoint.cached = value
+
+        return value
+
+    def next_delay(self, ok):
+        if ok:
+            self.failures = 0
+            return self.interval
+
+        # offline, back off exponentially with jitter so a dead uplink isn't hammered
+        self.failures += 1
+        delay = min(self.max_backoff, self.interval * 2**self.failures)
+        return random.uniform(delay / 2, delay)
+
+    def on_status_changed(self, key):
+        if key == "connectivity":
+            self.failures = 0
+            self.wake()
+            return
+
+        # the signal strength changes all the time, only a link going up or down is worth probing again
+        interfaces = self.runtime.get_status("interfaces")
+        links = None
+        if interfaces is not None:
+            links = tuple((device.interface, device.state, device.ip4) for device in interfaces.devices)
+
+        if links != self.links:
+            if self.links is not None:
+                log.debug("interfaces changed, probing the wan again")
+                self.failures = 0
+                self.wake()
+            self.links = links
+
+    def get_stats(self):
+        return {
+            "handshakes": self.session.handshakes,
+            "requests": self.session.requests,
+            "hedged": self.hedged,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "latency": self.latency.get_stats(),
+            "endpoints": {endpoint.url: endpoint.get_stats() for endpoint in self.ip_endpoints + self.online_endpoints},
+        }
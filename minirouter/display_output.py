@@ -0,0 +1,192 @@
+import logging
+
+import zmq
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+# protocol versions, the legacy protocol is one byte per pixel without any header
+PROTOCOL_LEGACY = 0
+PROTOCOL_PACKED = 1
+PROTOCOL_DELTA = 2
+PROTOCOL_HEARTBEAT = 3
+
+PROTOCOL_VERSION = PROTOCOL_HEARTBEAT
+
+PROTOCOLS = {
+    "legacy": PROTOCOL_LEGACY,
+    "packed": PROTOCOL_PACKED,
+    "delta": PROTOCOL_DELTA,
+    "heartbeat": PROTOCOL_HEARTBEAT,
+}
+
+# header byte of the versioned messages
+MSG_HELLO = 0xF0
+MSG_FRAME = 0xF1
+MSG_DELTA = 0xF2
+MSG_HEARTBEAT = 0xF3
+
+ACK = b"a"
+
+
+class DisplayTimeoutError(Exception):
+    pass
+
+
+def pack_pages(image):
+    # SSD1306 native layout: one byte per column for each 8 rows page, LSB at the top.
+    # Rotated clockwise each column becomes a packed row holding its pages in reverse order,
+    # so the pages can be gathered with strided slices.
+    if image.height % 8:
+        raise ValueError("image height must be a multiple of 8")
+
+    pages = image.height // 8
+    data = image.convert("1").transpose(Image.Transpose.ROTATE_270).tobytes()
+
+    return b"".join(data[pages - 1 - page :: pages] for page in range(pages))
+
+
+def encode_legacy(image):
+    return image.convert("L").tobytes()
+
+
+def diff_pages(old, new, width):
+    # one changed (page, first column, end column) range per page
+    ranges = []
+
+    for page, start in enumerate(range(0, len(new), width)):
+        changed = int.from_bytes(old[start : start + width], "little") ^ int.from_bytes(
+            new[start : start + width], "little"
+        )
+        if not changed:
+            continue
+
+        first = ((changed & -changed).bit_length() - 1) // 8
+        last = (changed.bit_length() - 1) // 8
+        ranges.append((page, first, last + 1))
+
+    return ranges
+
+
+def encode_delta(frame, ranges, width):
+    data = bytearray((MSG_DELTA, len(ranges)))
+    for page, first, end in ranges:
+        offset = page * width
+        data += bytes((page, first, end - first))
+        data += frame[offset + first : offset + end]
+    return bytes(data)
+
+
+class DisplayClient:
+    def __init__(self, address, display_size, protocol="auto", delta_max_ratio=0.5, timeout=2):
+        self.address = address
+        self.display_size = display_size
+        self.protocol = protocol
+        self.delta_max_ratio = delta_max_ratio
+        self.timeout = timeout
+        self.context = zmq.Context()
+        self.socket = None
+        self.version = None
+        # the last frame the server acknowledged, deltas are computed against it
+        self.acked_frame = None
+
+    def connect(self):
+        # a dealer socket doesn't get stuck waiting for a reply like a req socket,
+        # it only needs the empty delimiter frame the rep side expects
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.setsockopt(zmq.SNDTIMEO, int(self.timeout * 1000))
+        self.socket.connect(self.address)
+        self.acked_frame = None
+
+        if self.protocol == "auto":
+            self.version = self.negotiate()
+        else:
+            self.version = PROTOCOLS[self.protocol]
+
+        log.info("using display protocol version %s", self.version)
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.socket = None
+        self.acked_frame = None
+
+    def negotiate(self):
+        # legacy servers take any message as a frame and reply with a bare ack
+        reply = self.request(bytes((MSG_HELLO,)))
+        if len(reply) >= 2 and reply[:1] == ACK:
+            return min(reply[1], PROTOCOL_VERSION)
+
+        return PROTOCOL_LEGACY
+
+    def request(self, data):
+        try:
+            self.socket.send_multipart([b"", data])
+        except zmq.Again:
+            raise DisplayTimeoutError("timed out sending to the display server")
+
+        if not self.socket.poll(int(self.timeout * 1000), zmq.POLLIN):
+            raise DisplayTimeoutError("timed out waiting for the display server")
+
+        return self.socket.recv_multipart()[-1]
+
+    def encode(self, image):
+        if self.version >= PROTOCOL_PACKED:
+            return pack_pages(image)
+
+        return encode_legacy(image)
+
+    def build_message(self, frame):
+        if self.version < PROTOCOL_PACKED:
+            return frame
+
+        if self.version >= PROTOCOL_DELTA and self.acked_frame is not None:
+            width = self.display_size[0]
+            ranges = diff_pages(self.acked_frame, frame, width)
+            changed = sum(end - first for _, first, end in ranges)
+
+            if changed <= len(frame) * self.delta_max_ratio:
+                return encode_delta(frame, ranges, width)
+
+        return bytes((MSG_FRAME,)) + frame
+
+    def send(self, frame):
+        message = self.build_message(frame)
+        reply = self.request(message)
+
+        if reply != ACK and self.version >= PROTOCOL_DELTA and message[0] == MSG_DELTA:
+            # a restarted server doesn't have the frame the delta is based on, it needs the whole frame
+            self.acked_frame = None
+            reply = self.request(self.build_message(frame))
+
+        if reply != ACK:
+            log.error("Received unexpected response from display server")
+            self.acked_frame = None
+            return False
+
+        self.acked_frame = frame
+        return True
+
+    def heartbeat(self):
+        if self.acked_frame is None:
+            return False
+
+        if self.version >= PROTOCOL_HEARTBEAT:
+            if self.request(bytes((MSG_HEARTBEAT,))) != ACK:
+                # a restarted server has no frame to keep on, it gets the whole frame again
+                log.info("heartbeat refused, resending the frame")
+                frame, self.acked_frame = self.acked_frame, None
+                return self.send(frame)
+            return True
+
+        # older servers only know about frames
+        return self.send(self.acked_frame)
+
+    def clear(self):
+        self.send(self.encode(Image.new("1", self.display_size)))
+
+    def close(self):
+        self.disconnect()
+        self.context.term()
@@ -0,0 +1,265 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from enum import Enum
+from pathlib import Path
+from time import monotonic, time
+
+from sdbus_block.networkmanager import ConnectivityState, DeviceState, DeviceType
+
+from .collectors.base import UNCHANGED, Collector
+from .records import RECORDS
+
+log = logging.getLogger(__name__)
+
+ENUMS = {enum.__name__: enum for enum in (ConnectivityState, DeviceState, DeviceType)}
+
+# The file has two header slots, each pointing to its own snapshot area, followed by a ring of fixed size
+# samples. A commit writes the inactive snapshot area and then the inactive header with a higher sequence
+# number, so a crash in the middle of it leaves the previous commit intact.
+MAGIC = b"MRH1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQIIII")
+CRC = struct.Struct("<I")
+HEADER_SLOT_SIZE = 64
+SNAPSHOT_OFFSET = 4096
+SAMPLE = struct.Struct("<dIf")
+
+# status keys that aren't worth restoring
+SKIPPED_KEYS = {"time"}
+
+
+def series_id(name):
+    return zlib.crc32(name.encode())
+
+
+def encode_value(value):
+    if isinstance(value, Enum):
+        return {"enum": type(value).__name__, "value": value.value}
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return {"record": type(value).__name__, "fields": [encode_value(item) for item in value]}
+    if isinstance(value, tuple):
+        return {"tuple": [encode_value(item) for item in value]}
+    if isinstance(value, array):
+        return {"array": value.typecode, "items": value.tolist()}
+    return value
+
+
+def decode_value(value):
+    if not isinstance(value, dict):
+        return value
+    if "enum" in value:
+        return ENUMS[value["enum"]](value["value"])
+    if "record" in value:
+        return RECORDS[value["record"]](*[decode_value(item) for item in value["fields"]])
+    if "tuple" in value:
+        return tuple(decode_value(item) for item in value["tuple"])
+    if "array" in value:
+        return array(value["array"], value["items"])
+    raise ValueError(f"unknown value {value!r}")
+
+
+class HistoryFile:
+    def __init__(self, path, capacity=65536, snapshot_size=32768):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.snapshot_size = snapshot_size
+        self.ring_offset = SNAPSHOT_OFFSET + 2 * snapshot_size
+        self.size = self.ring_offset + capacity * SAMPLE.size
+
+        self.seq = 0
+        self.slot = 1
+        self.head = 0
+        self.count = 0
+        self.snapshot = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                # a different layout can't be read anyway, start over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            self.mm = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+        self.load()
+
+    def read_header(self, slot):
+        offset = slot * HEADER_SLOT_SIZE
+        header = self.mm[offset : offset + HEADER.size]
+        magic, version, header_slot, seq, length, head, count, capacity = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or header_slot != slot or capacity != self.capacity:
+            return None
+        if length > self.snapshot_size or head >= capacity or count > capacity:
+            return None
+
+        area = SNAPSHOT_OFFSET + slot * self.snapshot_size
+        snapshot = self.mm[area : area + length]
+        (crc,) = CRC.unpack_from(self.mm, offset + HEADER.size)
+        if zlib.crc32(header + snapshot) != crc:
+            return None
+
+        return seq, head, count, snapshot
+
+    def load(self):
+        headers = [(slot, self.read_header(slot)) for slot in (0, 1)]
+        valid = [(header[0], slot, header) for slot, header in headers if header is not None]
+        if not valid:
+            return
+
+        _, self.slot, (self.seq, self.head, self.count, snapshot) = max(valid)
+        try:
+            self.snapshot = json.loads(snapshot) if snapshot else None
+        except ValueError:
+            log.warning("unreadable history snapshot")
+
+    def restore(self, store):
+        if not self.snapshot:
+            return
+
+        restored = 0
+        for key, value in self.snapshot["statuses"].items():
+            try:
+                store.set(key, decode_value(value))
+                restored += 1
+            except Exception as ex:
+                log.info("error restoring %s from the history: %s", key, str(ex))
+
+        log.info("restored %d statuses saved at %s", restored, self.snapshot["time"])
+
+    def append(self, timestamp, series, value):
+        offset = self.ring_offset + self.head * SAMPLE.size
+        SAMPLE.pack_into(self.mm, offset, timestamp, series, value)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def commit(self, snapshot):
+        data = json.dumps(snapshot, separators=(",", ":")).encode()
+        if len(data) > self.snapshot_size:
+            log.warning("history snapshot too big (%d bytes), keeping the previous one", len(data))
+            data = None
+
+        slot = 1 - self.slot
+        if data is None:
+            # the samples still get committed, pointing at a copy of the previous snapshot
+            previous = self.read_header(self.slot)
+            data = previous[3] if previous is not None else b""
+
+        area = SNAPSHOT_OFFSET + slot * self.snapshot_size
+        self.mm[area : area + len(data)] = data
+
+        header = HEADER.pack(MAGIC, VERSION, slot, self.seq + 1, len(data), self.head, self.count, self.capacity)
+        offset = slot * HEADER_SLOT_SIZE
+        self.mm[offset : offset + HEADER.size] = header
+        CRC.pack_into(self.mm, offset + HEADER.size, zlib.crc32(header + data))
+
+        self.slot = slot
+        self.seq += 1
+
+    def samples(self, series=None):
+        # yields the committed (time, series id, value) samples from the oldest
+        start = (self.head - self.count) % self.capacity
+        for idx in range(self.count):
+            offset = self.ring_offset + ((start + idx) % self.capacity) * SAMPLE.size
+            sample = SAMPLE.unpack_from(self.mm, offset)
+            if series is None or sample[1] == series:
+                yield sample
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+
+
+def open_history(options):
+    try:
+        return HistoryFile(
+            options.get("path", "/var/lib/minirouter/history.bin"),
+            capacity=options.get("capacity", 65536),
+            snapshot_size=options.get("snapshot_size", 32768),
+        )
+    except OSError as ex:
+        log.warning("history disabled: %s", str(ex))
+        return None
+
+
+class HistoryRecorder(Collector):
+    # Saves the statuses and a few time series to the history file whenever the store changed. The file is
+    # memory mapped, the flush to storage only happens every flush_interval to spare the flash.
+    interval = 1
+
+    def __init__(self, name, options, history):
+        super().__init__(name, options)
+        self.history = history
+        self.flush_interval = options.get("flush_interval", 60)
+        self.version = None
+        # status key -> its version when its series were last sampled
+        self.sampled = {}
+        self.last_flush = monotonic()
+        self.commits = 0
+
+    async def run(self):
+        try:
+            await super().run()
+        finally:
+            self.history.flush()
+
+    async def collect(self):
+        snapshot = self.runtime.store.snapshot()
+        if snapshot.version != self.version:
+            self.version = snapshot.version
+            self.record(snapshot)
+
+        if monotonic() - self.last_flush >= self.flush_interval:
+            self.last_flush = monotonic()
+            self.history.flush()
+
+        return UNCHANGED
+
+    def record(self, snapshot):
+        now = time()
+
+        # only the series of the keys that changed get a sample, the others would only repeat their last one
+        changed = {key for key, version in snapshot.versions.items() if self.sampled.get(key) != version}
+        self.sampled = dict(snapshot.versions)
+
+        for name, value in self.get_series(snapshot, changed):
+            self.history.append(now, series_id(name), value)
+
+        statuses = {
+            key: encode_value(value)
+            for key, value in snapshot.values.items()
+            if key not in SKIPPED_KEYS and value is not None
+        }
+        self.history.commit({"time": now, "statuses": statuses})
+        self.commits += 1
+
+    def get_series(self, snapshot, changed):
+        if "throughput" in changed:
+            for item in snapshot.get("throughput") or ():
+                yield f"throughput.{item.interface}.rx", item.rx
+                yield f"throughput.{item.interface}.tx", item.tx
+
+        if "latency" in changed:
+            for item in snapshot.get("latency") or ():
+                if item.p50 is not None:
+                    yield f"latency.{item.target}.p50", item.p50
+                if item.loss is not None:
+                    yield f"latency.{item.target}.loss", item.loss
+
+        if "interfaces" in changed:
+            interfaces = snapshot.get("interfaces")
+            wifi = interfaces.wifi_device if interfaces is not None else None
+            if wifi is not None and wifi.strength is not None:
+                yield "wifi.strength", wifi.strength
+
+    def get_stats(self):
+        return {"commits": self.commits, "samples": self.history.count}
@@ -0,0 +1,194 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import threading
+from collections import namedtuple
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+# button is "a" or "b", time is the monotonic time the event was read
+InputEvent = namedtuple("InputEvent", "button source time")
+
+INPUT_DIR = "/dev/input"
+
+IN_ATTRIB = 0x004
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+
+def watch_directory(path, mask):
+    # returns an inotify fd watching the directory, or None where inotify isn't available
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError) as ex:
+        log.info("inotify not available: %s", str(ex))
+        return None
+
+    if fd < 0:
+        log.info("inotify not available: %s", os.strerror(ctypes.get_errno()))
+        return None
+
+    if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+        log.info("can't watch %s: %s", path, os.strerror(ctypes.get_errno()))
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+class InputMultiplexer:
+    # A single thread waits on every keyboard and the buttons server at once and hands the presses to
+    # on_event. Keyboards are picked up and dropped as they come and go, from inotify events on /dev/input,
+    # or by rescanning every rescan_interval where inotify isn't available.
+    def __init__(self, on_event, buttons_server=None, rescan_interval=10):
+        self.on_event = on_event
+        self.buttons_server = buttons_server
+        self.rescan_interval = rescan_interval
+        # fd -> evdev device
+        self.devices = {}
+        # device paths that aren't keyboards
+        self.ignored = set()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        import zmq
+
+        poller = zmq.Poller()
+
+        hotplug = watch_directory(INPUT_DIR, IN_CREATE | IN_DELETE | IN_ATTRIB)
+        if hotplug is not None:
+            poller.register(hotplug, zmq.POLLIN)
+
+        context = None
+        subscriber = None
+        if self.buttons_server:
+            context = zmq.Context()
+            subscriber = context.socket(zmq.SUB)
+            subscriber.connect(self.buttons_server["address"])
+            subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+            poller.register(subscriber, zmq.POLLIN)
+            log.info("Waiting for buttons server events...")
+
+        self.rescan(poller)
+        last_scan = monotonic()
+
+        try:
+            while True:
+                timeout = None if hotplug is not None else self.rescan_interval * 1000
+                for item, _ in poller.poll(timeout):
+                    if item is subscriber:
+                        self.read_buttons(subscriber)
+                    elif item == hotplug:
+                        drain(hotplug)
+                        self.rescan(poller)
+                    else:
+                        self.read_device(poller, item)
+
+                if hotplug is None and monotonic() - last_scan >= self.rescan_interval:
+                    self.rescan(poller)
+                    last_scan = monotonic()
+        except Exception:
+            log.exception("input thread stopped")
+        finally:
+            for device in self.devices.values():
+                device.close()
+            if hotplug is not None:
+                os.close(hotplug)
+            if subscriber is not None:
+                subscriber.close()
+                context.term()
+
+    def rescan(self, poller):
+        import evdev
+        import zmq
+
+        paths = set(evdev.list_devices())
+        self.ignored &= paths
+
+        for fd, device in list(self.devices.items()):
+            if device.path not in paths:
+                self.remove_device(poller, fd)
+
+        known = {device.path for device in self.devices.values()}
+        for path in paths - known - self.ignored:
+            try:
+                device = evdev.InputDevice(path)
+            except OSError:
+                # udev may still be setting the permissions, the attribute change triggers another scan
+                continue
+
+            if evdev.ecodes.KEY_A not in device.capabilities().get(evdev.ecodes.EV_KEY, []):
+                device.close()
+                self.ignored.add(path)
+                continue
+
+            log.info("listening to %s (%s)", device.name, path)
+            self.devices[device.fd] = device
+            poller.register(device.fd, zmq.POLLIN)
+
+    def remove_device(self, poller, fd):
+        device = self.devices.pop(fd)
+        log.info("%s (%s) is gone", device.name, device.path)
+        poller.unregister(fd)
+        try:
+            device.close()
+        except OSError:
+            pass
+
+    def read_device(self, poller, fd):
+        from evdev import ecodes
+
+        device = self.devices.get(fd)
+        if device is None:
+            return
+
+        try:
+            for event in device.read():
+                if event.type != ecodes.EV_KEY or event.value != 0:
+                    continue
+
+                if event.code == ecodes.KEY_A:
+                    self.on_event(InputEvent("a", device.path, monotonic()))
+                elif event.code == ecodes.KEY_S:
+                    self.on_event(InputEvent("b", device.path, monotonic()))
+        except BlockingIOError:
+            pass
+        except OSError:
+            # unplugged, inotify may not have told yet
+            self.remove_device(poller, fd)
+
+    def read_buttons(self, subscriber):
+        import zmq
+
+        buttons_server = self.buttons_server
+        while True:
+            try:
+                button = int(subscriber.recv_string(zmq.NOBLOCK))
+            except zmq.Again:
+                return
+            except ValueError:
+                continue
+
+            button_num = abs(button)
+            is_pressed = button_num * buttons_server["direction"] == button
+
+            if is_pressed:
+                if button_num == buttons_server["button_a"]:
+                    self.on_event(InputEvent("a", "buttons_server", monotonic()))
+                elif button_num == buttons_server["button_b"]:
+                    self.on_event(InputEvent("b", "buttons_server", monotonic()))
@@ -0,0 +1,39 @@
+import threading
+from queue import Empty
+
+
+class Mailbox:
+    # a single slot queue, a new item replaces the one still waiting to be taken
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._full = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._full:
+                self.dropped += 1
+            self._item = item
+            self._full = True
+            self._cond.notify()
+
+    def offer(self, item):
+        # only fills the slot when it's empty, so it never replaces a newer item
+        with self._cond:
+            if self._full:
+                return False
+            self._item = item
+            self._full = True
+            self._cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._full, timeout):
+                raise Empty
+
+            item = self._item
+            self._item = None
+            self._full = False
+            return item
@@ -2,146 +2,37 @@ import json
 import logging
 import logging.config
 import os
-import threading
 from pathlib import Path
-from socket import gethostbyname
-from time import sleep, time
-
-import requests
-import requests.packages.urllib3.util.connection as urllib3_cn
-import sdbus
-from sdbus_block.networkmanager import (
-    AccessPoint,
-    DeviceState,
-    DeviceType,
-    IPv4Config,
-    NetworkDeviceGeneric,
-    NetworkDeviceWireless,
-    NetworkManager,
-)
+from time import monotonic
 
+from .scheduler import Scheduler
+from .status_store import StatusStore
 from .ui.main_ui import MainUi
 
-urllib3_cn.HAS_IPV6 = False
-
 log = logging.getLogger("minirouter.main")
 
 
-statuses = {
-    "interfaces": None,
-    "dns": None,
-    "wan_ip": None,
-    "time": None,
-}
-
-
-def get_interfaces(network_manager, interfaces=None):
-    devices = {"devices": {}, "wifi": None}
-
-    for path, device in sorted(
-        [(path, NetworkDeviceGeneric(path)) for path in network_manager.devices], key=lambda item: item[1].interface
-    ):
-        if interfaces and device.interface not in interfaces:
-            continue
-
-        device_type = DeviceType(device.device_type)
-        state = DeviceState(device.state)
-
-        info = {
-            "interface": device.interface,
-            "state": state,
-            "ip4": "-",
-            "type": device_type,
-            "ssid": "-",
-        }
-
-        if state is DeviceState.ACTIVATED:
-            ip = IPv4Config(device.ip4_config)
-            try:
-                if ip.address_data:
-                    ipa = ip.address_data[0]
-                    info["ip4"] = f"{ipa['address'][1]}/{ipa['prefix'][1]}"
-
-            except Exception as ex:
-                log.info("error getting ip: %s", str(ex))
-                info["ip4"] = "E"
-
-            try:
-                if device_type is DeviceType.WIFI:
-                    devices["wifi"] = device.interface
-
-                    wlan = NetworkDeviceWireless(path)
-                    if wlan.active_access_point:
-                        ap = AccessPoint(wlan.active_access_point)
-                        info["ssid"] = ap.ssid.decode()
-                        info["strength"] = ap.strength
-                    else:
-                        info["ssid"] = None
-                        info["strength"] = None
-            except Exception as ex:
-                log.info("error getting ssid: %s", str(ex))
-                info["ssid"] = "* error *"
-
-        devices["devices"][device.interface] = info
-
-    return devices
-
-
-def run_interfaces_loop(interfaces, refresh_rate):
-    sdbus.set_default_bus(sdbus.sd_bus_open_system())
-    network_manager = NetworkManager()
-
-    while True:
-        try:
-            res = get_interfaces(network_manager, interfaces=interfaces)
-            statuses["interfaces"] = res
-        except Exception:
-            log.exception("error in ips loop")
-        sleep(refresh_rate)
-
-
-def check_dns_working(hostname):
-    try:
-        return gethostbyname(hostname)
-    except Exception as ex:
-        log.info("error checking dns: %s", str(ex))
-        return None
-
-
-def run_dns_loop(hostname, refresh_rate):
-    while True:
-        try:
-            is_dns_working = check_dns_working(hostname)
-            statuses["dns"] = bool(is_dns_working)
-        except Exception:
-            log.exception("error in dns loop")
-            statuses["dns"] = False
-        sleep(refresh_rate)
+STATUS_KEYS = ("interfaces", "connectivity", "dns", "wan_ip", "throughput", "latency", "time")
 
 
-def get_wan_ip():
-    is_ip = False
-    if statuses["dns"]:
-        res = requests.get("https://share.us.davidrios.dev/myip")
-        is_ip = True
-    else:
-        res = requests.get("http://1.1.1.1")
-
-    if res.status_code != 200:
-        return "-error-"
+def process_age():
+    # seconds since the process was started, interpreter startup included
+    try:
+        with open("/proc/self/stat") as fp:
+            # the fields after the command name, which may contain spaces, start at the third one
+            start_ticks = int(fp.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as fp:
+            uptime = float(fp.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
 
-    return res.content.decode() if is_ip else "online"
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
 
 
-def run_wan_ip_loop(refresh_rate):
-    while True:
-        try:
-            wan_ip = get_wan_ip()
-            statuses["wan_ip"] = wan_ip
-        except Exception:
-            log.exception("error in wan ip loop")
-            statuses["wan_ip"] = "-error-"
-        sleep(refresh_rate)
+def log_first_frame():
+    age = process_age()
+    if age is not None:
+        log.info("first frame out %.0fms after the process started", age * 1000)
 
 
 def main():
@@ -158,39 +49,52 @@ def main():
 
     refresh_rate = config["data_refresh_rate"]
 
-    threading.Thread(
-        target=run_interfaces_loop,
-        args=(config.get("interfaces"), refresh_rate),
-        daemon=True,
-    ).start()
-
-    threading.Thread(
-        target=run_dns_loop,
-        args=(config.get("check_dns", "google.com"), refresh_rate),
-        daemon=True,
-    ).start()
-
-    threading.Thread(
-        target=run_wan_ip_loop,
-        args=(refresh_rate,),
-        daemon=True,
-    ).start()
-
-    ui = MainUi(config, statuses)
+    store = StatusStore(STATUS_KEYS)
+    scheduler = Scheduler()
+
+    # the splash goes out before the slow imports (D-Bus bindings, collectors) and the history restore
+    ui = MainUi(config, store, wake=scheduler.wake, on_first_frame=log_first_frame)
+    ui.start_output()
+    ui.draw()
+
+    from .collectors import CollectorRuntime, load_collectors
+    from .history import HistoryRecorder, open_history
+
+    # the last known statuses are shown until the collectors catch up
+    history = None
+    history_config = config.get("history", {})
+    if history_config.get("enabled", True):
+        history = open_history(history_config)
+        if history is not None:
+            history.restore(store)
+
+    runtime = CollectorRuntime(store)
+    for collector in load_collectors(config):
+        runtime.add(collector)
+    if history is not None:
+        runtime.add(HistoryRecorder("history", history_config, history))
+    runtime.start()
+
+    store.subscribe(ui.on_status_changed)
     ui.initialize()
 
     last_debug = 0
 
     try:
         while True:
-            if time() - last_debug > refresh_rate:
-                log.debug("statuses: %s", statuses)
-                last_debug = time()
-
-            ui.draw()
-            sleep(0.01)
+            if monotonic() - last_debug > refresh_rate:
+                log.debug("statuses: %s", store.snapshot().values)
+                log.debug("wakeups per minute: %.1f", scheduler.wakeups_per_minute)
+                log.debug("frames: %s", ui.get_stats())
+                log.debug("collectors: %s", runtime.get_stats())
+                last_debug = monotonic()
+
+            scheduler.wait(ui.draw())
     except KeyboardInterrupt:
         log.info("exiting...")
+        runtime.stop(timeout=1)
+        if history is not None:
+            history.close()
         ui.cleanup()
 
 
@@ -0,0 +1,293 @@
+import logging
+import struct
+import threading
+from collections import Counter, deque, namedtuple
+from pathlib import Path
+from queue import Empty
+from time import monotonic, sleep, time
+
+from PIL import Image
+
+from .mailbox import Mailbox
+
+log = logging.getLogger(__name__)
+
+# packed 1bpp rows as Image.tobytes() gives them, they double as the frame fingerprint
+Frame = namedtuple("Frame", "size data")
+
+# recorded frame header: wall clock time, width and height
+RECORD = struct.Struct("<dHH")
+
+
+def frame_image(frame):
+    return Image.frombytes("1", frame.size, frame.data)
+
+
+class Output:
+    # Gets every new frame from the ui and delivers it from its own thread, at its own pace. Only the latest
+    # frame is kept while a delivery is in flight or the output waits for its next turn, so a slow output
+    # never holds up the ui or the other outputs.
+    min_interval = 0
+    # seconds without a new frame before idle() is called, None to never call it
+    idle_interval = None
+    stop_timeout = 2
+
+    def __init__(self, name, options, display_size, store=None, on_first_frame=None):
+        self.name = name
+        self.options = options
+        self.display_size = display_size
+        self.min_interval = options.get("min_interval", self.min_interval)
+        # called from the output thread after the first frame was delivered
+        self.on_first_frame = on_first_frame
+        # cleared while the ui is in deep standby, idle() is only called while it's set
+        self.keepalive = True
+        self.mailbox = Mailbox()
+        self.stats = Counter()
+        self.latencies = deque(maxlen=64)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        self.mailbox.put(("frame", frame))
+
+    def stop(self):
+        self.mailbox.put(("stop", None))
+        if self.thread is not None:
+            self.thread.join(self.stop_timeout)
+
+    def get_stats(self):
+        stats = dict(self.stats, dropped=self.mailbox.dropped + self.stats["dropped"])
+        if self.latencies:
+            stats["latency_ms"] = round(sum(self.latencies) / len(self.latencies) * 1000, 1)
+            stats["max_latency_ms"] = round(max(self.latencies) * 1000, 1)
+        return stats
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    kind, frame = self.mailbox.get(self.idle_interval)
+                except Empty:
+                    kind, frame = "idle", None
+
+                if kind == "stop":
+                    break
+
+                if kind == "idle":
+                    if self.keepalive:
+                        self.handle(kind, frame)
+                    continue
+
+                started = monotonic()
+                if self.handle(kind, frame):
+                    self.latencies.append(monotonic() - started)
+                    self.stats["delivered"] += 1
+                    if self.stats["delivered"] == 1 and self.on_first_frame is not None:
+                        self.on_first_frame()
+
+                if self.min_interval:
+                    # newer frames replace each other in the mailbox meanwhile
+                    sleep(max(0, started + self.min_interval - monotonic()))
+        finally:
+            self.close()
+
+    def handle(self, kind, frame):
+        # returns whether the frame was delivered
+        try:
+            if kind == "frame":
+                self.deliver(frame)
+                return True
+            self.idle()
+        except Exception:
+            log.exception("error in %s output", self.name)
+            self.stats["errors"] += 1
+        return False
+
+    def deliver(self, frame):
+        raise NotImplementedError
+
+    def idle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullOutput(Output):
+    # only counts the frames, for measuring the rendering on its own
+    def deliver(self, frame):
+        pass
+
+
+class DisplayOutput(Output):
+    # the OLED behind the ZMQ display server
+    def __init__(self, name, options, display_size, store=None, on_first_frame=None):
+        super().__init__(name, options, display_size, store=store, on_first_frame=on_first_frame)
+        from .display_output import DisplayClient
+
+        timeout = options.get("timeout", 2)
+        self.client = DisplayClient(
+            options["server"],
+            display_size,
+            protocol=options.get("protocol", "auto"),
+            timeout=timeout,
+        )
+        self.min_interval = options.get("refresh_rate", 1)
+        # keeps the display server from powering off the screen while the frame doesn't change
+        self.idle_interval = options.get("keepalive_interval", 30)
+        self.reconnect_delay = options.get("reconnect_delay", 1)
+        self.stop_timeout = timeout * 2
+        self.connected = False
+        self.last_frame = None
+
+    def handle(self, kind, frame):
+        from .display_output import DisplayTimeoutError
+
+        try:
+            if not self.connected:
+                self.client.connect()
+                self.connected = True
+
+            if kind == "frame":
+                self.last_frame = frame
+                return self.send(frame)
+
+            if self.client.acked_frame is None and self.last_frame is not None:
+                # the server may have restarted, it needs the whole frame again
+                self.send(self.last_frame)
+            else:
+                self.client.heartbeat()
+            self.stats["heartbeats"] += 1
+        except DisplayTimeoutError as ex:
+            log.warning("%s, reconnecting", str(ex))
+            self.stats["timeouts"] += 1
+            self.client.disconnect()
+            self.connected = False
+
+            # retried after reconnecting, unless a newer frame arrives in the meantime
+            if not self.mailbox.offer((kind, frame)) and kind == "frame":
+                # a newer frame already took its place
+                self.stats["dropped"] += 1
+            sleep(self.reconnect_delay)
+        except Exception:
+            log.exception("error in %s output", self.name)
+            self.stats["errors"] += 1
+
+        return False
+
+    def send(self, frame):
+        if not self.client.send(self.client.encode(frame_image(frame))):
+            self.stats["errors"] += 1
+            return False
+        return True
+
+    def close(self):
+        from .display_output import DisplayTimeoutError
+
+        try:
+            if self.connected:
+                self.client.clear()
+        except DisplayTimeoutError:
+            pass
+        self.client.close()
+
+
+class WebOutput(Output):
+    # the web view, the frames are encoded by the server when a client asks for them
+    def __init__(self, name, options, display_size, store=None, on_first_frame=None):
+        super().__init__(name, options, display_size, store=store, on_first_frame=on_first_frame)
+        from .web_output import FrameFeed, get_server
+
+        self.feed = FrameFeed()
+        self.server = get_server(self.feed, scale=options.get("scale", 1), options=options, store=store)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        super().start()
+
+    def deliver(self, frame):
+        self.feed.publish(frame.size, frame.data)
+
+    def get_stats(self):
+        return dict(super().get_stats(), **self.server.get_stats())
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FileRecorder(Output):
+    # appends every frame to a file, with its time and size, keeping the previous file once it gets too big
+    def __init__(self, name, options, display_size, store=None, on_first_frame=None):
+        super().__init__(name, options, display_size, store=store, on_first_frame=on_first_frame)
+        self.path = Path(options.get("path", "frames.rec"))
+        self.max_size = options.get("max_size", 4 * 1024 * 1024)
+        self.fp = None
+
+    def deliver(self, frame):
+        if self.fp is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fp = self.path.open("ab")
+
+        if self.fp.tell() >= self.max_size:
+            self.fp.close()
+            self.path.replace(self.path.with_name(self.path.name + ".1"))
+            self.fp = self.path.open("ab")
+
+        self.fp.write(RECORD.pack(time(), *frame.size) + frame.data)
+        self.fp.flush()
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+
+
+def read_recording(path):
+    # yields the (time, frame) pairs of a file written by FileRecorder
+    with open(path, "rb") as fp:
+        while header := fp.read(RECORD.size):
+            if len(header) < RECORD.size:
+                break
+            timestamp, width, height = RECORD.unpack(header)
+            data = fp.read((width + 7) // 8 * height)
+            if len(data) < (width + 7) // 8 * height:
+                break
+            yield timestamp, Frame((width, height), data)
+
+
+OUTPUTS = {
+    "display": DisplayOutput,
+    "web": WebOutput,
+    "file": FileRecorder,
+    "null": NullOutput,
+}
+
+
+def load_outputs(config, display_size, store=None, on_first_frame=None):
+    # "output" is an output type, a {"type": ..., options} object or a list of those
+    entries = config.get("output", "display")
+    if not isinstance(entries, list):
+        entries = [entries]
+
+    defaults = {
+        "display": config.get("display", {}),
+        "web": {"scale": config.get("output_scale", 1), **config.get("web", {})},
+    }
+
+    outputs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"type": entry}
+
+        kind = entry["type"]
+        if kind not in OUTPUTS:
+            raise ValueError(f"unknown output {kind!r}")
+
+        options = {**defaults.get(kind, {}), **entry}
+        name = options.get("name", kind)
+        outputs.append(OUTPUTS[kind](name, options, display_size, store=store, on_first_frame=on_first_frame))
+
+    return outputs
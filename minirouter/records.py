@@ -0,0 +1,41 @@
+from collections import namedtuple
+
+InterfaceInfo = namedtuple("InterfaceInfo", "interface state ip4 type ssid strength", defaults=(None,))
+
+
+class Interfaces(namedtuple("Interfaces", "devices wifi")):
+    # devices is a tuple of InterfaceInfo sorted by interface name, wifi the name of the active wifi interface
+    __slots__ = ()
+
+    def get(self, interface):
+        for device in self.devices:
+            if device.interface == interface:
+                return device
+        return None
+
+    @property
+    def wifi_device(self):
+        if self.wifi is None:
+            return None
+        return self.get(self.wifi)
+
+
+ResolverStatus = namedtuple("ResolverStatus", "address ok rtt error")
+
+
+class DnsStatus(namedtuple("DnsStatus", "ok resolvers")):
+    # ok when at least one resolver answered, resolvers is a tuple of ResolverStatus
+    __slots__ = ()
+
+
+# rates in bytes per second, the histories are arrays from the oldest to the newest sample
+InterfaceThroughput = namedtuple("InterfaceThroughput", "interface rx tx rx_history tx_history")
+
+# milliseconds, loss as a fraction of the probes in the window
+LatencyStatus = namedtuple("LatencyStatus", "target p50 p95 jitter loss probes")
+
+# by name, to restore the records saved in the history file
+RECORDS = {
+    record.__name__: record
+    for record in (InterfaceInfo, Interfaces, ResolverStatus, DnsStatus, InterfaceThroughput, LatencyStatus)
+}
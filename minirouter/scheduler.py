@@ -0,0 +1,36 @@
+import threading
+from collections import deque
+from time import monotonic
+
+
+class Scheduler:
+    def __init__(self, window=60):
+        self.window = window
+        self._event = threading.Event()
+        self._wakeups = deque()
+
+    def wake(self):
+        self._event.set()
+
+    def wait(self, timeout=None):
+        # a timeout of None means there is no deadline pending, sleep until woken up
+        if timeout is not None:
+            timeout = max(timeout, 0)
+
+        woken = self._event.wait(timeout)
+        self._event.clear()
+
+        now = monotonic()
+        self._wakeups.append(now)
+        while now - self._wakeups[0] > self.window:
+            self._wakeups.popleft()
+
+        return woken
+
+    @property
+    def wakeups_per_minute(self):
+        now = monotonic()
+        while self._wakeups and now - self._wakeups[0] > self.window:
+            self._wakeups.popleft()
+
+        return len(self._wakeups) * 60 / self.window
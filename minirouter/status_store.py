@@ -0,0 +1,76 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Snapshot:
+    # a consistent view of the store, read with the same interface as a dict
+    __slots__ = ("values", "version", "versions")
+
+    def __init__(self, version, values, versions):
+        self.version = version
+        self.values = values
+        self.versions = versions
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def get_version(self, key):
+        return self.versions.get(key, 0)
+
+
+class StatusStore:
+    # Every change bumps the store version and the changed key gets it as its own version, so readers can tell
+    # whether anything they depend on moved since the last time they looked.
+    def __init__(self, keys=()):
+        self._cond = threading.Condition()
+        self._values = dict.fromkeys(keys)
+        self._versions = dict.fromkeys(keys, 0)
+        self._subscribers = []
+        self.version = 0
+
+    def get(self, key, default=None):
+        with self._cond:
+            return self._values.get(key, default)
+
+    def get_version(self, key):
+        with self._cond:
+            return self._versions.get(key, 0)
+
+    def set(self, key, value):
+        with self._cond:
+            if key in self._values and self._values[key] == value:
+                return False
+
+            self.version += 1
+            self._values[key] = value
+            self._versions[key] = self.version
+            self._cond.notify_all()
+
+        # a failing subscriber mustn't stop the others, or the collector that published
+        for callback in self._subscribers:
+            try:
+                callback(key)
+            except Exception:
+                log.exception("error notifying a change of %s", key)
+
+        return True
+
+    def snapshot(self):
+        with self._cond:
+            return Snapshot(self.version, dict(self._values), dict(self._versions))
+
+    def subscribe(self, callback):
+        # the callback is called with the changed key, from the thread that changed it
+        self._subscribers.append(callback)
+
+    def wait_for_change(self, since, timeout=None):
+        # returns a snapshot once the store version is past since, or None on timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.version > since, timeout):
+                return None
+            return Snapshot(self.version, dict(self._values), dict(self._versions))
@@ -1,17 +1,15 @@
 import logging
-import threading
-from collections import namedtuple
-from io import BytesIO
+from collections import Counter, deque, namedtuple
 from pathlib import Path
-from time import time
+from queue import Empty, SimpleQueue
+from time import monotonic
 
-import evdev
-import zmq
 from PIL import Image, ImageDraw, ImageFont
 from statemachine import State, StateMachine
 
-from .menu import MainMenu
+from ..outputs import Frame
 from .status import StatusUi
+from .text import BitmapFont
 
 log = logging.getLogger(__name__)
 
@@ -31,102 +29,74 @@ class MainUi(StateMachine):
     show_menu = on_status.to(on_menu)
     back_to_status = on_menu.to(on_status) | on_status.to(on_status)
 
-    def __init__(self, config, statuses):
+    def __init__(self, config, store, wake=None, on_first_frame=None):
         self.config = config
-        self.statuses = statuses
+        self.store = store
+        self.wake = wake or (lambda: None)
+        self.on_first_frame = on_first_frame
         self.display_size = Size(*self.config["display"]["size"])
-        self.font = ImageFont.truetype(FONT_FILE, config["display"]["font_size"])
-        self.status_ui = StatusUi(self.display_size, self.font, self.statuses)
-        self.menu_ui = MainMenu(self.display_size, self.font)
+        self.font = BitmapFont(ImageFont.truetype(FONT_FILE, config["display"]["font_size"]))
+        self.status_ui = StatusUi(
+            self.display_size,
+            self.font,
+            self.store,
+            throughput_interface=config["display"].get("throughput_interface"),
+        )
+        self._menu_ui = None
         self.last_draw = 0
-        self.last_display_refresh = 0
-        self.last_data = None
-        self.last_image = None
-        self.last_interaction = 0
+        self.sent_data = None
+        self.frame_stats = Counter()
+        self.input_events = SimpleQueue()
+        # read times of the presses the next frame will show, and how long the last presses took to show
+        self.pending_inputs = []
+        self.input_latencies = deque(maxlen=64)
+        self.last_interaction = monotonic()
         self.in_standby = False
 
-        self.display_backend = None
+        self.outputs = []
 
         super().__init__()
 
+    @property
+    def menu_ui(self):
+        # built on first use, it pulls in the NetworkManager bindings
+        if self._menu_ui is None:
+            from .menu import MainMenu
+
+            self._menu_ui = MainMenu(self.display_size, self.font, on_change=self.request_redraw)
+        return self._menu_ui
+
+    def start_output(self):
+        from ..outputs import load_outputs
+
+        self.outputs = load_outputs(
+            self.config,
+            self.display_size,
+            store=self.store,
+            on_first_frame=self.first_frame_out,
+        )
+        for output in self.outputs:
+            output.start()
+
+    def first_frame_out(self):
+        callback, self.on_first_frame = self.on_first_frame, None
+        if callback is not None:
+            callback()
+
     def do_initialization(self):
         log.debug("doing initialization")
 
-        def listen_kbd(kbd):
-            for event in kbd.read_loop():
-                if event.value != 0:
-                    continue
-
-                try:
-                    if event.code == evdev.ecodes.KEY_A:
-                        self.press_a()
-                    elif event.code == evdev.ecodes.KEY_S:
-                        self.press_b()
-                except Exception:
-                    log.exception("error processing key press")
-
-        kbds = [
-            d
-            for d in [evdev.InputDevice(path) for path in evdev.list_devices()]
-            if evdev.ecodes.KEY_A in d.capabilities().get(evdev.events.EV_KEY, [])
-        ]
-
-        for kbd in kbds:
-            threading.Thread(
-                target=listen_kbd,
-                args=(kbd,),
-                daemon=True,
-            ).start()
-
-        if self.config["output"] == "web":
-            from ..web_output import get_server
-
-            def serve_web():
-                get_server(lambda: self.last_data).serve_forever()
-
-            threading.Thread(
-                target=serve_web,
-                daemon=True,
-            ).start()
-        elif self.config["output"] == "display":
-            ctx = zmq.Context()
-            sock = ctx.socket(zmq.REQ)
-            sock.connect(self.config["display"]["server"])
-            self.display_server = sock
-
-        buttons_server = self.config.get("buttons_server")
-        if buttons_server:
-
-            def buttons_server_loop():
-                context = zmq.Context()
-                subscriber = context.socket(zmq.SUB)
-
-                subscriber.connect(buttons_server["address"])
-                subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
-
-                log.info("Waiting for buttons server events...")
-
-                try:
-                    while True:
-                        button = int(subscriber.recv_string())
-                        button_num = abs(button)
-                        is_pressed = button_num * buttons_server["direction"] == button
-
-                        if is_pressed:
-                            if button_num == buttons_server["button_a"]:
-                                self.press_a()
-                            elif button_num == buttons_server["button_b"]:
-                                self.press_b()
-                finally:
-                    subscriber.close()
-                    context.term()
-
-            threading.Thread(
-                target=buttons_server_loop,
-                daemon=True,
-            ).start()
-
-        self.last_interaction = time()
+        from ..inputs import InputMultiplexer
+
+        # a single thread reads every input, the presses are handled in the ui loop
+        self.input = InputMultiplexer(
+            self.queue_input,
+            buttons_server=self.config.get("buttons_server"),
+            rescan_interval=self.config.get("input_rescan_interval", 10),
+        )
+        self.input.start()
+
+        self.last_interaction = monotonic()
 
         self.blank_image = Image.new("1", self.display_size)
 
@@ -134,9 +104,34 @@ class MainUi(StateMachine):
 
     def after_initialize(self):
         self.start_status()
+        # replaces the splash right away
+        self.last_draw = 0
 
     def after_back_to_status(self):
-        self.menu_ui.reset()
+        if self._menu_ui is not None:
+            self._menu_ui.reset()
+
+    def queue_input(self, event):
+        # called from the input thread
+        self.input_events.put(event)
+        self.wake()
+
+    def handle_inputs(self):
+        while True:
+            try:
+                event = self.input_events.get_nowait()
+            except Empty:
+                return
+
+            try:
+                if event.button == "a":
+                    self.press_a()
+                elif event.button == "b":
+                    self.press_b()
+            except Exception:
+                log.exception("error processing key press")
+
+            self.pending_inputs.append(event.time)
 
     def press_a(self):
         if not self.in_standby:
@@ -158,22 +153,55 @@ class MainUi(StateMachine):
         self.force_refresh()
 
     def force_refresh(self):
-        self.last_display_refresh = 0
         self.last_draw = 0
-        self.last_interaction = time()
+        self.last_interaction = monotonic()
         self.in_standby = False
+        self.set_keepalive(True)
+        self.wake()
 
-    def draw(self):
-        if time() - self.last_interaction >= self.config["standby_timeout"]:
-            self.back_to_status()
-            self.in_standby = True
+    def set_keepalive(self, keepalive):
+        for output in self.outputs:
+            output.keepalive = keepalive
 
-        if time() - self.last_interaction >= self.config["standby_timeout"] * 2:
-            # return later to give a chance to draw the blank screen
+    def request_redraw(self):
+        self.last_draw = 0
+        self.wake()
+
+    def on_status_changed(self, key):
+        if self.in_standby:
+            return
+
+        # a status the shown page doesn't use can wait for the regular refresh
+        if self.current_state.id == "on_status" and not self.status_ui.depends_on(key):
             return
 
-        if time() - self.last_draw >= self.config["data_refresh_rate"]:
-            self.last_draw = time()
+        self.request_redraw()
+
+    def draw(self):
+        # returns the seconds until the next deadline, or None to sleep until woken up
+        self.handle_inputs()
+
+        standby_timeout = self.config["standby_timeout"]
+
+        if monotonic() - self.last_interaction >= standby_timeout:
+            self.back_to_status()
+            if not self.in_standby:
+                self.in_standby = True
+                self.last_draw = 0
+
+        if monotonic() - self.last_interaction >= standby_timeout * 2:
+            # the outputs let the screen power off, this returns later to give a chance to draw the blank screen
+            self.set_keepalive(False)
+            return None
+
+        if self.current_state.id == "on_menu" and not self.in_standby:
+            menu_deadline = self.menu_ui.next_deadline()
+            if menu_deadline is not None and monotonic() >= menu_deadline:
+                # an expired message is only taken off the screen by rendering again
+                self.last_draw = 0
+
+        if monotonic() - self.last_draw >= self.config["data_refresh_rate"]:
+            self.last_draw = monotonic()
             image = None
 
             if self.in_standby:
@@ -186,25 +214,52 @@ class MainUi(StateMachine):
                 else:
                     image = self.draw_initializing()
 
-            if self.config["output"] == "web":
-                scale = self.config.get("output_scale", 1)
-                image = image.resize([i * scale for i in image.size])
-
-                data = BytesIO()
-                image.save(data, "bmp")
-                self.last_data = data
-            elif self.config["output"] == "display":
-                self.last_data = bytearray(image.get_flattened_data())
-
-            self.last_image = image
+            self.frame_stats["rendered"] += 1
 
-        if time() - self.last_display_refresh >= self.config["display"]["refresh_rate"]:
-            self.last_display_refresh = time()
-
-            if self.config["output"] == "display" and self.last_image is not None:
-                self.display_server.send(self.last_data)
-                if self.display_server.recv() != b"a":
-                    log.error("Received unexpected response from display server")
+            # rendered once for every output, each one encodes the packed pixels its own way from its own thread
+            data = image.tobytes()
+            if data == self.sent_data:
+                self.frame_stats["skipped"] += 1
+            else:
+                frame = Frame(image.size, data)
+                for output in self.outputs:
+                    output.submit(frame)
+                self.sent_data = data
+                self.frame_stats["submitted"] += 1
+
+            # press to frame, the time it took for the presses to be reflected in a frame
+            now = monotonic()
+            self.input_latencies.extend(now - read_time for read_time in self.pending_inputs)
+            self.frame_stats["inputs"] += len(self.pending_inputs)
+            self.pending_inputs.clear()
+
+        return self.next_deadline() - monotonic()
+
+    def get_stats(self):
+        stats = dict(self.frame_stats)
+        if self.input_latencies:
+            stats["input_latency_ms"] = round(sum(self.input_latencies) / len(self.input_latencies) * 1000, 1)
+            stats["max_input_latency_ms"] = round(max(self.input_latencies) * 1000, 1)
+        for output in self.outputs:
+            stats[output.name] = output.get_stats()
+        return stats
+
+    def next_deadline(self):
+        if self.in_standby:
+            # the blank screen was already drawn, only the deep standby is left
+            deadlines = [self.last_interaction + self.config["standby_timeout"] * 2]
+        else:
+            deadlines = [
+                self.last_interaction + self.config["standby_timeout"],
+                self.last_draw + self.config["data_refresh_rate"],
+            ]
+
+            if self.current_state.id == "on_menu":
+                menu_deadline = self.menu_ui.next_deadline()
+                if menu_deadline is not None:
+                    deadlines.append(menu_deadline)
+
+        return min(deadlines)
 
     def draw_initializing(self):
         image = Image.new("1", self.display_size)
@@ -214,16 +269,10 @@ class MainUi(StateMachine):
         # clear display
         draw.rectangle((0, 0, *self.display_size), outline=0, fill=0, width=0)
 
-        draw.text(
-            (0, -2),
-            "Initializing...",
-            font=self.font,
-            fill=1,
-        )
+        self.font.draw_text(draw, (0, -2), "Initializing...")
 
         return image
 
     def cleanup(self):
-        if self.config["output"] == "display":
-            self.display_server.send(b"\x00" * self.display_size[0] * self.display_size[1])
-            self.display_server.recv()
+        for output in self.outputs:
+            output.stop()
@@ -2,10 +2,9 @@ import logging
 import threading
 from itertools import islice
 from subprocess import check_call
-from time import time
+from time import monotonic
 
 import sdbus
-from PIL import Image, ImageDraw
 from sdbus_block.networkmanager import (
     ActiveConnection,
     DeviceType,
@@ -15,6 +14,8 @@ from sdbus_block.networkmanager import (
     NetworkManagerSettings,
 )
 
+from .widgets import RowWidget, Screen, TextWidget
+
 log = logging.getLogger(__name__)
 
 
@@ -35,12 +36,18 @@ class BaseMenu:
     options = []
     submenus = {}
 
-    def __init__(self, display_size, font):
+    def __init__(self, display_size, font, on_change=None):
         self.display_size = display_size
         self.font = font
+        self.on_change = on_change
         self.highlighted = 0
         self.in_submenu = None
-        self.submenus = {idx: c(display_size, font) for idx, c in self.submenus.items()}
+        # submenus are built the first time they are entered
+        self.built_submenus = {}
+        self.screen = Screen(
+            display_size,
+            [RowWidget((0, -2 + (idx * 8)), font) for idx in range(self.max_lines)],
+        )
 
     def _get_options(self):
         options = self.options[:]
@@ -51,9 +58,21 @@ class BaseMenu:
     def _get_options_pages(self):
         return list(batched(self._get_options(), self.max_lines))
 
+    def get_submenu(self, option):
+        submenu = self.built_submenus.get(option)
+        if submenu is None and option in self.submenus:
+            submenu = self.submenus[option](self.display_size, self.font, on_change=self.on_change)
+            self.built_submenus[option] = submenu
+        return submenu
+
     def do_action(self, option):
         log.debug("%s: selected option %s", self.__class__.__name__, option)
 
+    def next_deadline(self):
+        if self.in_submenu is not None:
+            return self.in_submenu.next_deadline()
+        return None
+
     def reset(self):
         self.highlighted = 0
         if self.in_submenu is not None:
@@ -71,7 +90,7 @@ class BaseMenu:
             return
 
         if self.in_submenu is None:
-            self.in_submenu = self.submenus.get(self.highlighted)
+            self.in_submenu = self.get_submenu(self.highlighted)
             if self.in_submenu is not None:
                 return
 
@@ -86,7 +105,7 @@ class BaseMenu:
             new_highlighted = 0
         self.highlighted = new_highlighted
 
-    def draw_options(self, draw):
+    def draw_options(self):
         pages = self._get_options_pages()
         try:
             page = pages[int(self.highlighted / self.max_lines)]
@@ -94,37 +113,18 @@ class BaseMenu:
             page = pages[0]
             self.highlighted = 0
 
-        for idx, opt in enumerate(page):
-            draw.text(
-                (0, -2 + (idx * 8)),
-                f"  {opt}",
-                font=self.font,
-                fill=1,
-            )
+        cursor_pos = self.highlighted % self.max_lines
+
+        for idx, row in enumerate(self.screen.widgets):
+            row.set((page[idx], idx == cursor_pos) if idx < len(page) else None)
 
     def draw(self):
         if self.in_submenu is not None:
             return self.in_submenu.draw()
 
-        image = Image.new("1", self.display_size)
-
-        draw = ImageDraw.Draw(image)
-
-        # clear display
-        draw.rectangle((0, 0, *self.display_size), outline=0, fill=0, width=0)
+        self.draw_options()
 
-        self.draw_options(draw)
-
-        cursor_pos = self.highlighted % self.max_lines
-
-        draw.text(
-            (0, -2 + (cursor_pos * 8)),
-            ">",
-            font=self.font,
-            fill=1,
-        )
-
-        return image
+        return self.screen.render()
 
 
 class AnotherMenu(BaseMenu):
@@ -141,13 +141,13 @@ class BigMenu(BaseMenu):
 class WifiConnectMenu(BaseMenu):
     has_go_back = True
 
-    def __init__(self, display_size, font):
-        super().__init__(display_size, font)
+    def __init__(self, display_size, font, on_change=None):
+        super().__init__(display_size, font, on_change=on_change)
         self.is_updating = False
         self.is_updated = False
         self.wifis = []
         self.wifis_paths = []
-        self.message_drawer = MessageDrawer(display_size, font)
+        self.message_drawer = MessageDrawer(display_size, font, on_change=on_change)
 
     @property
     def options(self):
@@ -226,6 +226,9 @@ class WifiConnectMenu(BaseMenu):
             args=(path,),
         ).start()
 
+    def next_deadline(self):
+        return self.message_drawer.next_deadline()
+
     def press_a(self):
         if self.message_drawer.has_message:
             return
@@ -269,49 +272,48 @@ class MainMenu(BaseMenu):
 
 
 class MessageDrawer:
-    def __init__(self, display_size, font):
+    def __init__(self, display_size, font, on_change=None):
         self.display_size = display_size
         self.font = font
+        self.on_change = on_change
         self.lines = []
         self.timeout = 5
-        self.image = None
         self.has_message = False
         self.last_draw = 0
+        self.screen = Screen(
+            display_size,
+            [TextWidget((0, -2 + (idx * 8)), font) for idx in range(BaseMenu.max_lines)],
+        )
 
     def set_message(self, lines, timeout=60):
         self.lines = lines
         self.timeout = timeout
-        self.image = None
         self.has_message = True
-        self.last_draw = time()
+        self.last_draw = monotonic()
+        self.notify_change()
 
     def clear_message(self):
         self.has_message = False
+        self.notify_change()
+
+    def notify_change(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def next_deadline(self):
+        if not self.has_message:
+            return None
+        return self.last_draw + self.timeout
 
     def draw_message(self):
         if not self.has_message:
             return
 
-        if time() - self.last_draw >= self.timeout:
+        if monotonic() - self.last_draw >= self.timeout:
             self.has_message = False
             return
 
-        if self.image is None:
-            image = Image.new("1", self.display_size)
-
-            draw = ImageDraw.Draw(image)
-
-            # clear display
-            draw.rectangle((0, 0, *self.display_size), outline=0, fill=0, width=0)
-
-            for idx, line in enumerate(self.lines):
-                draw.text(
-                    (0, -2 + (idx * 8)),
-                    line,
-                    font=self.font,
-                    fill=1,
-                )
-
-            self.image = image
+        for idx, row in enumerate(self.screen.widgets):
+            row.set(self.lines[idx] if idx < len(self.lines) else None)
 
-        return self.image
+        return self.screen.render()
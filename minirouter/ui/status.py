@@ -1,10 +1,11 @@
 import logging
 from datetime import datetime
+from functools import partial
 
-from PIL import Image, ImageDraw
 from statemachine import State, StateMachine
 
 from .images import WIFI_SIGNALS
+from .widgets import IconWidget, Screen, SparklineWidget, TextWidget
 
 log = logging.getLogger(__name__)
 
@@ -12,13 +13,20 @@ log = logging.getLogger(__name__)
 class StatusUi(StateMachine):
     showing_page1 = State(initial=True)
     showing_page2 = State()
+    showing_page3 = State()
 
-    cycle = showing_page1.to(showing_page2) | showing_page2.to(showing_page1)
+    cycle = showing_page1.to(showing_page2) | showing_page2.to(showing_page3) | showing_page3.to(showing_page1)
 
-    def __init__(self, display_size, font, statuses):
+    max_lines = 4
+
+    sparkline_height = 11
+
+    def __init__(self, display_size, font, store, throughput_interface=None):
         self.display_size = display_size
         self.font = font
-        self.statuses = statuses
+        self.store = store
+        self.throughput_interface = throughput_interface
+        self.screens = self.build_screens()
         super().__init__()
 
     def after_cycle(self):
@@ -31,92 +39,158 @@ class StatusUi(StateMachine):
         pass
 
     def draw(self):
-        image = Image.new("1", self.display_size)
+        return self.screens[self.current_state.id].render(self.store.snapshot())
+
+    def depends_on(self, key):
+        # whether the page being shown uses the status key
+        return any(key in widget.keys for widget in self.screens[self.current_state.id].widgets)
+
+    def build_screens(self):
+        return {
+            "showing_page1": Screen(
+                self.display_size,
+                [
+                    TextWidget((0, -2), self.font, self.wifi_text, keys=("interfaces",)),
+                    IconWidget((108, 8), self.wifi_signal, keys=("interfaces",)),
+                    TextWidget((0, 6), self.font, self.dns_text, keys=("dns",)),
+                    TextWidget((0, 14), self.font, self.wan_text, keys=("wan_ip",)),
+                    TextWidget((0, 22), self.font, self.time_text),
+                ],
+            ),
+            "showing_page2": Screen(
+                self.display_size,
+                [
+                    TextWidget((0, -2 + (8 * idx)), self.font, partial(self.interface_text, idx), keys=("interfaces",))
+                    for idx in range(self.max_lines - 1)
+                ]
+                + [
+                    # the latency summary takes the last line when there is one
+                    TextWidget(
+                        (0, -2 + (8 * (self.max_lines - 1))),
+                        self.font,
+                        self.last_line_text,
+                        keys=("interfaces", "latency"),
+                    )
+                ],
+            ),
+            "showing_page3": Screen(
+                self.display_size,
+                [
+                    TextWidget((0, -2), self.font, self.throughput_text, keys=("throughput",)),
+                    SparklineWidget(
+                        (0, self.display_size.height - self.sparkline_height * 2 - 1),
+                        (self.display_size.width, self.sparkline_height),
+                        partial(self.throughput_history, "rx_history"),
+                        keys=("throughput",),
+                    ),
+                    SparklineWidget(
+                        (0, self.display_size.height - self.sparkline_height),
+                        (self.display_size.width, self.sparkline_height),
+                        partial(self.throughput_history, "tx_history"),
+                        keys=("throughput",),
+                    ),
+                ],
+            ),
+        }
+
+    def get_wifi(self, statuses):
+        interfaces = statuses["interfaces"]
+        if interfaces is None:
+            return None
 
-        draw = ImageDraw.Draw(image)
+        return interfaces.wifi_device
 
-        # clear display
-        draw.rectangle((0, 0, *self.display_size), outline=0, fill=0, width=0)
+    def wifi_text(self, statuses):
+        wifi = self.get_wifi(statuses)
+        if wifi is None:
+            return "wifi: -"
 
-        if self.current_state.id == "showing_page1":
-            signal = self.draw_wifi(draw)
-            signal_image = WIFI_SIGNALS[signal]
-            image.paste(signal_image, (108, 8))
+        return f"wifi: {wifi.ssid or '-'}"
 
-            self.draw_dns(draw)
-            self.draw_wan(draw)
+    def wifi_signal(self, statuses):
+        signal = None
 
-            self.draw_time(draw)
-        elif self.current_state.id == "showing_page2":
-            self.draw_interfaces(draw)
+        wifi = self.get_wifi(statuses)
+        if wifi is not None and wifi.strength is not None:
+            if wifi.strength <= 0:
+                signal = 0
+            elif wifi.strength >= 100:
+                signal = 4
+            else:
+                signal = int(wifi.strength / 25) + 1
 
-        return image
+        return WIFI_SIGNALS[signal]
 
-    def draw_wifi(self, draw):
-        text = "wifi: "
-        signal = None
+    def dns_text(self, statuses):
+        dns = statuses["dns"]
+        status = "online" if dns is not None and dns.ok else "offline"
+        return f"dns: {status}"
 
-        interfaces = self.statuses["interfaces"]
+    def wan_text(self, statuses):
+        status = statuses["wan_ip"] or "offline"
+        return f"wan: {status}"
+
+    def time_text(self, statuses):
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def interface_text(self, idx, statuses):
+        interfaces = statuses["interfaces"]
         if interfaces is None:
-            text += "-"
-        else:
-            wifi = interfaces["devices"].get(interfaces["wifi"])
+            return None
 
-            if wifi is None:
-                text += "-"
-            else:
-                text += wifi["ssid"]
-                if wifi["strength"] <= 0:
-                    signal = 0
-                elif wifi["strength"] >= 100:
-                    signal = 4
-                else:
-                    signal = int(wifi["strength"] / 25) + 1
-
-        draw.text(
-            (0, -2),
-            text,
-            font=self.font,
-            fill=1,
-        )
-
-        return signal
-
-    def draw_dns(self, draw):
-        status = "online" if self.statuses["dns"] else "offline"
-
-        draw.text(
-            (0, 6),
-            f"dns: {status}",
-            font=self.font,
-            fill=1,
-        )
-
-    def draw_wan(self, draw):
-        status = self.statuses["wan_ip"] or "offline"
-
-        draw.text(
-            (0, 14),
-            f"wan: {status}",
-            font=self.font,
-            fill=1,
-        )
-
-    def draw_time(self, draw):
-        text = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        draw.text(
-            (0, 22),
-            text,
-            font=self.font,
-            fill=1,
-        )
-
-    def draw_interfaces(self, draw):
-        for idx, device in enumerate(self.statuses["interfaces"]["devices"].values()):
-            draw.text(
-                (0, -2 + (8 * idx)),
-                f"{device['interface']}:{device.get('ip4') or '-'}",
-                font=self.font,
-                fill=1,
-            )
+        if idx >= len(interfaces.devices):
+            return None
+
+        device = interfaces.devices[idx]
+        return f"{device.interface}:{device.ip4 or '-'}"
+
+    def last_line_text(self, statuses):
+        if statuses["latency"]:
+            return self.latency_text(statuses)
+        return self.interface_text(self.max_lines - 1, statuses)
+
+    def latency_text(self, statuses):
+        # the first target is the one that matters
+        latency = statuses["latency"][0]
+        if latency.p50 is None:
+            return f"ping: - loss:{latency.loss:.0%}"
+
+        return f"ping:{latency.p50:.0f}/{latency.p95:.0f}ms loss:{latency.loss:.0%}"
+
+    def get_throughput(self, statuses):
+        throughput = statuses["throughput"]
+        if not throughput:
+            return None
+
+        for item in throughput:
+            if item.interface == self.throughput_interface:
+                return item
+        return throughput[0]
+
+    def throughput_text(self, statuses):
+        throughput = self.get_throughput(statuses)
+        if throughput is None:
+            return "throughput: -"
+
+        return f"{throughput.interface} rx:{format_rate(throughput.rx)} tx:{format_rate(throughput.tx)}"
+
+    def throughput_history(self, attr, statuses):
+        throughput = self.get_throughput(statuses)
+        if throughput is None:
+            return None
+
+        return getattr(throughput, attr)
+
+
+def format_rate(value):
+    # bytes per second, short enough to fit two rates and the interface name in a line
+    for unit in ("", "K", "M"):
+        if value < 999.5:
+            break
+        value /= 1000
+    else:
+        unit = "G"
+
+    if unit and value < 9.95:
+        return f"{value:.1f}{unit}"
+    return f"{value:.0f}{unit}"
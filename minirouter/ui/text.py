@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+# printable ascii and latin-1, covers the portuguese menu texts
+DEFAULT_CHARSET = "".join(chr(c) for c in range(0x20, 0x7F)) + "".join(chr(c) for c in range(0xA0, 0x100))
+
+
+class BitmapFont:
+    # Text engine for fixed size monospaced bitmap fonts: every glyph is rasterized once into a 1-bit atlas,
+    # strings are blitted from it and the rendered strings are kept in a LRU cache.
+    def __init__(self, font, charset=DEFAULT_CHARSET, cache_size=64):
+        self.font = font
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        ascent, descent = font.getmetrics()
+        self.height = ascent + descent
+        self.advance = int(font.getlength("M"))
+
+        self.glyphs = {}
+        self.monospace = all(font.getlength(char) == self.advance for char in charset)
+        if self.monospace:
+            self.atlas = self._build_atlas(charset)
+
+    def _build_atlas(self, charset):
+        atlas = Image.new("1", (self.advance * len(charset), self.height))
+        ImageDraw.Draw(atlas).text((0, 0), charset, font=self.font, fill=1)
+
+        for idx, char in enumerate(charset):
+            left = idx * self.advance
+            self.glyphs[char] = atlas.crop((left, 0, left + self.advance, self.height))
+
+        return atlas
+
+    def get_glyph(self, char):
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            glyph = Image.new("1", (self.advance, self.height))
+            ImageDraw.Draw(glyph).text((0, 0), char, font=self.font, fill=1)
+            self.glyphs[char] = glyph
+        return glyph
+
+    def render(self, text):
+        # returns the rendered text and its ink box, relative to the drawing position
+        rendered = self.cache.get(text)
+        if rendered is not None:
+            self.cache.move_to_end(text)
+            return rendered
+
+        if self.monospace:
+            image = Image.new("1", (self.advance * len(text), self.height))
+            for idx, char in enumerate(text):
+                image.paste(self.get_glyph(char), (idx * self.advance, 0))
+        else:
+            image = Image.new("1", (int(self.font.getlength(text)), self.height))
+            ImageDraw.Draw(image).text((0, 0), text, font=self.font, fill=1)
+
+        rendered = (image, image.getbbox())
+
+        self.cache[text] = rendered
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return rendered
+
+    def getbbox(self, text):
+        return self.render(text)[1]
+
+    def draw_text(self, draw, position, text):
+        image, bbox = self.render(text)
+        if bbox is not None:
+            draw.bitmap(position, image, fill=1)
@@ -0,0 +1,199 @@
+from PIL import Image, ImageDraw
+
+
+def intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def offset_box(box, position):
+    if box is None:
+        return None
+
+    x, y = position
+    return (box[0] + x, box[1] + y, box[2] + x, box[3] + y)
+
+
+def union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class Widget:
+    def __init__(self, position, source=None, keys=()):
+        self.position = position
+        # called with a statuses snapshot to get the widget value, only when one of the keys changed
+        self.source = source
+        self.keys = keys
+        self.value = None
+        self.dirty = True
+        # the box the widget currently occupies on the screen and the one it will after the next render
+        self.drawn_box = None
+        self.next_box = None
+        self._seen = None
+
+    def update(self, statuses):
+        if self.source is None:
+            return
+
+        if self.keys:
+            seen = tuple(statuses.get_version(key) for key in self.keys)
+            if seen == self._seen:
+                return
+            self._seen = seen
+
+        self.set(self.source(statuses))
+
+    def set(self, value):
+        if value != self.value:
+            self.value = value
+            self.dirty = True
+
+    def bounds(self):
+        raise NotImplementedError
+
+    def render(self, image, draw):
+        raise NotImplementedError
+
+
+class TextWidget(Widget):
+    def __init__(self, position, font, source=None, keys=()):
+        super().__init__(position, source=source, keys=keys)
+        self.font = font
+
+    def bounds(self):
+        if not self.value:
+            return None
+
+        return offset_box(self.font.getbbox(self.value), self.position)
+
+    def render(self, image, draw):
+        if self.value:
+            self.font.draw_text(draw, self.position, self.value)
+
+
+class IconWidget(Widget):
+    def bounds(self):
+        if self.value is None:
+            return None
+
+        x, y = self.position
+        return (x, y, x + self.value.width, y + self.value.height)
+
+    def render(self, image, draw):
+        if self.value is not None:
+            image.paste(self.value, self.position)
+
+
+class RowWidget(Widget):
+    # a menu row, the value is the (text, selected) pair
+    def __init__(self, position, font, source=None, keys=()):
+        super().__init__(position, source=source, keys=keys)
+        self.font = font
+
+    def bounds(self):
+        if self.value is None:
+            return None
+
+        text, selected = self.value
+        box = offset_box(self.font.getbbox(f"  {text}"), self.position)
+
+        if selected:
+            box = union(box, offset_box(self.font.getbbox(">"), self.position))
+
+        return box
+
+    def render(self, image, draw):
+        if self.value is None:
+            return
+
+        text, selected = self.value
+        self.font.draw_text(draw, self.position, f"  {text}")
+        if selected:
+            self.font.draw_text(draw, self.position, ">")
+
+
+class SparklineWidget(Widget):
+    # a bar per sample, newest on the right, scaled to the highest sample shown
+    def __init__(self, position, size, source=None, keys=()):
+        super().__init__(position, source=source, keys=keys)
+        self.size = size
+
+    def bounds(self):
+        if self.value is None:
+            return None
+
+        x, y = self.position
+        return (x, y, x + self.size[0], y + self.size[1])
+
+    def render(self, image, draw):
+        if not self.value:
+            return
+
+        width, height = self.size
+        samples = self.value[-width:]
+        peak = max(samples) or 1
+
+        x, y = self.position
+        left = x + width - len(samples)
+        bottom = y + height - 1
+        for idx, sample in enumerate(samples):
+            if sample:
+                bar = max(1, round(sample * height / peak))
+                draw.line((left + idx, bottom - bar + 1, left + idx, bottom), fill=1)
+
+
+class Screen:
+    # a persistent framebuffer, only the widgets that changed (and whatever they overlap) are redrawn
+    def __init__(self, size, widgets):
+        self.image = Image.new("1", size)
+        self.draw = ImageDraw.Draw(self.image)
+        self.widgets = widgets
+        self.version = None
+
+    def render(self, statuses=None):
+        if statuses is not None:
+            # when the store didn't move only the widgets that don't depend on it can change
+            unchanged = statuses.version == self.version
+            self.version = statuses.version
+            for widget in self.widgets:
+                if not (unchanged and widget.keys):
+                    widget.update(statuses)
+
+        redraw = [widget for widget in self.widgets if widget.dirty]
+        if not redraw:
+            return self.image
+
+        regions = []
+        for widget in redraw:
+            widget.next_box = widget.bounds()
+            regions.extend(box for box in (widget.drawn_box, widget.next_box) if box is not None)
+
+        # widgets overlapping a cleared region have to be redrawn too, and so do the ones overlapping those
+        pending = [widget for widget in self.widgets if not widget.dirty and widget.drawn_box is not None]
+        found = True
+        while found:
+            found = False
+            for widget in pending[:]:
+                if any(intersects(widget.drawn_box, region) for region in regions):
+                    pending.remove(widget)
+                    widget.next_box = widget.drawn_box
+                    regions.append(widget.drawn_box)
+                    redraw.append(widget)
+                    found = True
+
+        for left, top, right, bottom in regions:
+            if right <= left or bottom <= top:
+                continue
+            self.draw.rectangle((left, top, right - 1, bottom - 1), outline=0, fill=0, width=0)
+
+        # drawn in the screen order so overlapping widgets stack the same as in a full redraw
+        for widget in self.widgets:
+            if widget in redraw:
+                widget.render(self.image, self.draw)
+                widget.drawn_box = widget.next_box
+                widget.dirty = False
+
+        return self.image
@@ -1,66 +1,386 @@
+import hashlib
+import json
+import logging
 import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+from array import array
+from base64 import b64encode
+from collections import Counter
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+# a comment line is sent when no frame changed for this long, so dead clients are noticed
+STREAM_KEEPALIVE = 15
+
+# the longest a status long-poll is held open
+MAX_POLL_TIMEOUT = 60
+
+IMAGE_TYPES = {"bmp": "image/bmp", "png": "image/png"}
+
+BUSY_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+INDEX_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: sans-serif; text-align: center; padding: 50px; background-color: black; }
+        canvas { border: 5px solid #333; margin-top: 20px; image-rendering: pixelated; }
+    </style>
+</head>
+<body>
+    <canvas></canvas>
+    <script>
+        const scale = %(scale)d
+        const canvas = document.querySelector('canvas')
+        const frame = document.createElement('canvas')
+
+        function draw(width, height, packed) {
+            if (frame.width !== width || frame.height !== height) {
+                frame.width = width
+                frame.height = height
+                canvas.width = width * scale
+                canvas.height = height * scale
+            }
+
+            const context = frame.getContext('2d')
+            const pixels = context.createImageData(width, height)
+            const stride = Math.ceil(width / 8)
+            for (let y = 0; y < height; y++) {
+                for (let x = 0; x < width; x++) {
+                    const on = packed.charCodeAt(y * stride + (x >> 3)) & (0x80 >> (x & 7))
+                    const offset = (y * width + x) * 4
+                    pixels.data[offset] = pixels.data[offset + 1] = pixels.data[offset + 2] = on ? 255 : 0
+                    pixels.data[offset + 3] = 255
+                }
+            }
+            context.putImageData(pixels, 0, 0)
+
+            const scaled = canvas.getContext('2d')
+            scaled.imageSmoothingEnabled = false
+            scaled.drawImage(frame, 0, 0, canvas.width, canvas.height)
+        }
+
+        const stream = new EventSource('/stream')
+        stream.addEventListener('frame', (event) => {
+            const [width, height, data] = event.data.split(' ')
+            draw(Number(width), Number(height), atob(data))
+        })
+    </script>
+</body>
+</html>
+"""
+
+
+def to_json(value):
+    # records become objects and enums their names, for the status API
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        return {field: to_json(item) for field, item in zip(value._fields, value)}
+    if isinstance(value, (tuple, list, array)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    return value
+
+
+class EncodedStatus:
+    # the statuses JSON is built once per store version, however many clients ask for it
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.version = None
+        self.body = None
+
+    def encode(self, snapshot):
+        with self.lock:
+            if snapshot.version != self.version:
+                data = {
+                    "version": snapshot.version,
+                    "statuses": {key: to_json(value) for key, value in snapshot.values.items()},
+                    "versions": snapshot.versions,
+                }
+                self.body = json.dumps(data, default=str).encode()
+                self.version = snapshot.version
+            return self.body
+
+    def get(self, since=None, timeout=0):
+        # with since, waits up to timeout for a version past it, and returns the current one if there is none
+        snapshot = None
+        # a version from before a restart can be past the current one, that isn't worth waiting for
+        if since is not None and since <= self.store.version and timeout > 0:
+            snapshot = self.store.wait_for_change(since, timeout)
+        if snapshot is None:
+            snapshot = self.store.snapshot()
+        return self.encode(snapshot)
+
+
+class FrameFeed:
+    # the latest frame as packed 1bpp rows, the streaming clients wait on it for the next one
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.size = None
+        self.data = None
+
+    def publish(self, size, data):
+        with self.condition:
+            self.version += 1
+            self.size = size
+            self.data = data
+            self.condition.notify_all()
+
+    def latest(self):
+        with self.condition:
+            return self.version, self.size, self.data
+
+    def wait(self, since, timeout):
+        # returns the current (version, size, data), as soon as the version isn't the given one
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != since, timeout)
+            return self.version, self.size, self.data
+
+
+class EncodedFrames:
+    # every frame is encoded once per format and the bytes are shared by all the clients
+    def __init__(self, feed, scale=1):
+        self.feed = feed
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.version = None
+        self.digest = None
+        self.encoded = {}
+        self.stats = Counter()
+
+    def get(self, image_format):
+        # returns the (etag, body) of the current frame, or None when there is no frame yet
+        version, size, data = self.feed.latest()
+        if data is None:
+            return None
+
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                # the etag comes from the pixels, so it survives restarts and repeated frames
+                self.digest = hashlib.blake2b(data + bytes(size), digest_size=8).hexdigest()
+                self.encoded = {}
+
+            body = self.encoded.get(image_format)
+            if body is None:
+                image = Image.frombytes("1", size, data)
+                if self.scale != 1:
+                    image = image.resize([i * self.scale for i in size])
+
+                buffer = BytesIO()
+                if image_format == "png":
+                    image.save(buffer, "png", optimize=True)
+                else:
+                    image.save(buffer, "bmp")
+                body = self.encoded[image_format] = buffer.getvalue()
+                self.stats["encoded"] += 1
+            else:
+                self.stats["shared"] += 1
+
+            return f'"{self.digest}-{self.scale}-{image_format}"', body
 
 
 class ImageHandler(BaseHTTPRequestHandler):
+    # keep-alive, every response but the event stream has a Content-Length
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # idle keep-alive connections don't hold a thread forever
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
     def do_GET(self):
-        if self.path == "/":
+        path = urlsplit(self.path).path
+        if path == "/":
             self.handle_index()
-        elif self.path.startswith("/image"):
-            self.handle_image()
+        elif path == "/stream":
+            self.handle_stream()
+        elif path in ("/image", "/image.bmp", "/image.png"):
+            self.handle_image(path.partition(".")[2] or self.server.image_format)
+        elif path == "/api/status" and self.server.status is not None:
+            self.handle_status()
         else:
             self.send_error(404, "Page Not Found")
 
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def send_body(self, content_type, body, headers=()):
+        self.send_response(200)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
     def handle_index(self):
+        self.send_body("text/html", (INDEX_HTML % {"scale": self.server.scale}).encode("utf-8"))
+
+    def handle_stream(self):
+        # server-sent events, each one carries "width height base64" of a frame that changed
+        if not self.server.start_stream():
+            self.send_error(503, "Too many streams")
+            return
+
+        try:
+            self.stream_frames()
+        finally:
+            self.server.stream_slots.release()
+
+    def stream_frames(self):
         self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
         self.end_headers()
+        self.close_connection = True
 
-        html_content = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body { font-family: sans-serif; text-align: center; padding: 50px; background-color: black; }
-                img { border: 5px solid #333; margin-top: 20px; }
-            </style>
-        </head>
-        <body>
-            <img src="/image" alt="Generated Content" />
-            <script>
-                const imgEl = document.querySelector('img')
-                setInterval(() => {
-                    imgEl.src = '/image?t=' + new Date()
-                }, 200)
-            </script>
-        </body>
-        </html>
-        """
-        self.wfile.write(html_content.encode("utf-8"))
-
-    def handle_image(self):
+        feed = self.server.feed
+        seen = 0
         try:
-            image_data = self.server.data_callback()
-            self.send_response(200)
-            self.send_header("Content-type", "image/bmp")
-            # self.send_header("Content-length", str(len(image_data)))
-            self.end_headers()
-            self.wfile.write(image_data.getbuffer())
+            while True:
+                version, size, data = feed.wait(seen, STREAM_KEEPALIVE)
+                if version == seen or data is None:
+                    self.wfile.write(b":\n\n")
+                else:
+                    seen = version
+                    self.wfile.write(b"event: frame\ndata: %d %d %s\n\n" % (*size, b64encode(data)))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            log.debug("stream client %s gone", self.address_string())
+
+    def handle_image(self, image_format):
+        # kept for clients that still poll a bitmap, they get a 304 while the frame is the same
+        try:
+            frame = self.server.frames.get(image_format)
         except Exception as e:
-            self.send_response(500)
+            log.exception("error encoding the frame")
+            self.send_error(500, f"Error generating image: {e}")
+            return
+
+        if frame is None:
+            self.send_error(503, "No frame yet")
+            return
+
+        etag, body = frame
+        if etag in self.headers.get("If-None-Match", ""):
+            self.server.stats["not_modified"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
             self.end_headers()
-            self.wfile.write(f"Error generating image: {e}".encode())
+            return
 
+        self.server.stats["images"] += 1
+        self.send_body(IMAGE_TYPES[image_format], body, [("ETag", etag), ("Cache-Control", "no-cache")])
+
+    def handle_status(self):
+        # /api/status?since=<version>&timeout=<seconds> blocks until the statuses move past that version
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            since = int(query["since"][0]) if "since" in query else None
+            timeout = min(float(query.get("timeout", ["30"])[0]), MAX_POLL_TIMEOUT)
+        except ValueError:
+            self.send_error(400, "Invalid since or timeout")
+            return
 
-class ImageServer(HTTPServer):
-    def __init__(self, server_address, RequestHandlerClass, data_callback):
+        self.server.stats["status"] += 1
+        self.send_body("application/json", self.server.status.get(since, timeout), [("Cache-Control", "no-store")])
+
+
+class ImageServer(ThreadingHTTPServer):
+    # A thread per connection, up to max_connections, the ones past that are turned away right away. The event
+    # streams stay open for as long as the page does, they count against max_streams instead.
+    def __init__(
+        self,
+        server_address,
+        RequestHandlerClass,
+        feed,
+        scale=1,
+        image_format="bmp",
+        max_connections=32,
+        max_streams=8,
+        idle_timeout=30,
+        store=None,
+    ):
         super().__init__(server_address, RequestHandlerClass)
-        self.data_callback = data_callback
+        self.feed = feed
+        self.status = EncodedStatus(store) if store is not None else None
+        self.scale = scale
+        self.image_format = image_format
+        self.idle_timeout = idle_timeout
+        self.frames = EncodedFrames(feed, scale)
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+        # whether the connection of the current thread holds one of the slots
+        self.holding = threading.local()
+        self.stats = Counter()
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.stats["rejected"] += 1
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        self.stats["connections"] += 1
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        self.holding.slot = True
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            if self.holding.slot:
+                self.slots.release()
+
+    def start_stream(self):
+        # called from the connection thread, a stream trades its connection slot for a stream slot
+        if not self.stream_slots.acquire(blocking=False):
+            self.stats["rejected_streams"] += 1
+            return False
+
+        self.stats["streams"] += 1
+        if self.holding.slot:
+            self.holding.slot = False
+            self.slots.release()
+        return True
+
+    def get_stats(self):
+        return dict(self.stats, **self.frames.stats)
 
 
 HOST_NAME = os.environ.get("HOST_NAME", "localhost")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
 
 
-def get_server(get_image):
-    return ImageServer((HOST_NAME, SERVER_PORT), ImageHandler, data_callback=get_image)
+def get_server(feed, scale=1, options=None, store=None):
+    options = options or {}
+    return ImageServer(
+        (HOST_NAME, SERVER_PORT),
+        ImageHandler,
+        feed,
+        scale=scale,
+        image_format=options.get("image_format", "bmp"),
+        max_connections=options.get("max_connections", 32),
+        max_streams=options.get("max_streams", 8),
+        idle_timeout=options.get("idle_timeout", 30),
+        store=store,
+    )